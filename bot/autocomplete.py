@@ -0,0 +1,55 @@
+import threading
+from itertools import islice, takewhile
+
+from sortedcontainers import SortedList
+
+from search import normalize
+
+
+class AutocompleteIndex():
+    """
+    In-memory index of names (user names, challenge titles) answering the Discord
+    autocompletes without touching the db.
+    Entries are (normalized name, name, id) tuples kept sorted, so that names
+    starting with the input are found by bisection; names containing it
+    elsewhere come next, found by a scan of the normalized names.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.entries = SortedList()
+        self.names = {}  # id => name
+
+    def load(self, items) -> None:
+        """Replace the index content with `items`, an iterable of (id, name)"""
+        with self.lock:
+            self.names = dict(items)
+            self.entries = SortedList((normalize(name), name, idx) for idx, name in self.names.items())
+
+    def set(self, idx, name) -> None:
+        with self.lock:
+            self._remove(idx)
+            self.names[idx] = name
+            self.entries.add((normalize(name), name, idx))
+
+    def remove(self, idx) -> None:
+        with self.lock:
+            self._remove(idx)
+
+    def _remove(self, idx) -> None:
+        if idx in self.names:
+            name = self.names.pop(idx)
+            self.entries.remove((normalize(name), name, idx))
+
+    def complete(self, text, limit=25) -> list:
+        """
+        Up to `limit` names containing `text` (accents and case ignored), sorted
+        alphabetically. Names starting with `text` are picked first.
+        """
+        text = normalize(text)
+        with self.lock:
+            # entries starting with `text` are contiguous in the sorted list
+            found = list(islice(takewhile(lambda entry: entry[0].startswith(text), self.entries.irange((text,))), limit))
+            if text and len(found) < limit:
+                contained = (entry for entry in self.entries if text in entry[0] and not entry[0].startswith(text))
+                found.extend(islice(contained, limit - len(found)))
+        return sorted((name for _, name, _ in found), key=str.lower)
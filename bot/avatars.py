@@ -0,0 +1,38 @@
+import asyncio
+import time
+
+import aiohttp
+
+
+class AvatarResolver():
+    """
+    Finds the Root-Me avatar of a user (jpg, png or the default one) with HEAD
+    requests on the shared aiohttp session. Resolved urls are cached for `ttl`
+    seconds, users without avatar for `negative_ttl` seconds.
+    """
+    BASE_URL = "https://www.root-me.org/IMG/logo/auton"
+    DEFAULT = f"{BASE_URL}0.png"
+
+    def __init__(self, session: aiohttp.ClientSession, ttl: float, negative_ttl: float) -> None:
+        self.session = session
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache = {}  # user id => (expiration, url)
+
+    async def get(self, user_id) -> str:
+        cached = self.cache.get(user_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        try:
+            for extension in ('jpg', 'png'):
+                url = f"{self.BASE_URL}{user_id}.{extension}"
+                async with self.session.head(url, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                    if response.status == 200:
+                        self.cache[user_id] = (time.monotonic() + self.ttl, url)
+                        return url
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return self.DEFAULT  # not cached, root-me.org may be back next time
+
+        self.cache[user_id] = (time.monotonic() + self.negative_ttl, self.DEFAULT)
+        return self.DEFAULT
@@ -0,0 +1,90 @@
+"""
+Latency of the autocompletes under load: in-memory index against the SQLite full text search.
+
+    python -m bench.autocomplete_bench --users 10000 --challenges 600 --clients 50 --keystrokes 20
+
+Fills a fresh database, then `clients` concurrent users type random names one
+keystroke at a time, while users keep being registered in the background.
+Every answer is timed and the histograms are compared to the 3 seconds
+Discord gives an autocomplete to answer.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+from bench.fake_rootme import FakeRootMe
+from db_executor import AsyncDBManager
+from db_manager import DBManager
+from latency import LatencyHistogram
+
+DEADLINE = 3000  # ms
+
+
+def user_data(idx, rng):
+    name = ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz0123456789_-') for _ in range(rng.randint(4, 14)))
+    return {'id_auteur': str(idx), 'nom': name, 'score': rng.randint(0, 50000), 'validations': []}
+
+
+async def type_names(db, names, keystrokes, histograms, rng):
+    """One client typing random names from the first letter, as Discord sends them"""
+    for _ in range(keystrokes):
+        name = rng.choice(names)
+        for end in range(1, min(len(name), 8) + 1):
+            with histograms['memory'].measure():
+                await db.completeUserNames(name[:end])
+            with histograms['sqlite'].measure():
+                await db.getUserByName(name[:end], limit=25)
+
+
+async def register_users(db, first_id, rng, stop):
+    """Background writes, as the import and the poller would do"""
+    idx = first_id
+    while not stop.is_set():
+        await db.newUsers([user_data(idx + i, rng) for i in range(20)])
+        idx += 20
+        await asyncio.sleep(0.01)
+
+
+async def run(args) -> None:
+    rng = random.Random(0)
+    db_file = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    with contextlib.redirect_stdout(io.StringIO()):
+        sync_db = DBManager(db_file)
+        for chall in FakeRootMe(args.challenges, 0, max_solves=0).challenges.values():
+            sync_db.newChallenge(chall)
+        sync_db.newUsers([user_data(idx, rng) for idx in range(1, args.users + 1)])
+    db = AsyncDBManager(sync_db, args.readers)
+    names = list(sync_db.users_completion.names.values())
+
+    histograms = {'memory': LatencyHistogram(), 'sqlite': LatencyHistogram()}
+    stop = asyncio.Event()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        writer = asyncio.create_task(register_users(db, args.users + 1, rng, stop))
+        await asyncio.gather(*(type_names(db, names, args.keystrokes, histograms, random.Random(i)) for i in range(args.clients)))
+        stop.set()
+        await writer
+    duration = time.perf_counter() - start
+
+    print(f"{args.users} users, {args.challenges} challenges, {args.clients} clients, "
+          f"{len(sync_db.users_completion.names) - args.users} users registered meanwhile, {duration:.1f} s")
+    for source, histogram in histograms.items():
+        print(f"{source:<8} {histogram.summary()}, {histogram.share_under(DEADLINE):.2%} within {DEADLINE} ms")
+
+    db.close()
+    os.remove(db_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--challenges', type=int, default=600)
+    parser.add_argument('--clients', type=int, default=50, help='users typing at the same time')
+    parser.add_argument('--keystrokes', type=int, default=20, help='names typed by each client')
+    parser.add_argument('--readers', type=int, default=4, help='db reader threads')
+    asyncio.run(run(parser.parse_args()))
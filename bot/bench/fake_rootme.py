@@ -0,0 +1,171 @@
+"""
+Local stand-in for the Root-Me API, serving a synthetic catalog and synthetic users.
+
+    python -m bench.fake_rootme --challenges 600 --users 300 --latency 0.05 --error-rate 0.02
+
+Then point RootMeAPI at it: RootMeAPI(api_key, base_api='http://127.0.0.1:8080')
+"""
+import argparse
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+from aiohttp import web
+
+CATEGORIES = ['App - Script', 'App - Système', 'Cracking', 'Cryptanalyse', 'Forensic', 'Programmation',
+              'Réaliste', 'Réseau', 'Stéganographie', 'Web - Client', 'Web - Serveur']
+DIFFICULTIES = ['Très facile', 'Facile', 'Moyen', 'Difficile', 'Très difficile']
+SCORES = [5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 65, 70, 75, 80, 85, 90, 95, 100]
+PAGE_SIZE = 50
+
+
+class FakeRootMe():
+    """
+    Synthetic Root-Me API: /challenges (paged with debut_challenges, oldest first unless
+    `newest_first`), /challenges/{id}, /auteurs?nom= and /auteurs/{id}.
+    Every request is delayed by `latency` seconds (+/- 50%), and a share `error_rate`
+    of them fails with a 429 (with Retry-After) or a 5xx.
+    """
+    def __init__(self, n_challenges=600, n_users=300, max_solves=300, latency=0.0, error_rate=0.0, seed=0, newest_first=False) -> None:
+        self.random = random.Random(seed)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.newest_first = newest_first
+        self.requests = 0
+        self.errors = 0
+        self.challenges = {}
+        self.users = {}
+        self.clock = datetime(2024, 1, 1)
+        self.base_url = ''
+
+        for idx in range(1, n_challenges + 1):
+            self.add_challenge(idx)
+
+        for idx in range(1, n_users + 1):
+            self.users[idx] = {'id_auteur': str(idx), 'nom': f'hacker{idx}', 'score': 0, 'position': 0, 'validations': []}
+            n_solves = int(self.random.paretovariate(1.2)) % max_solves if max_solves else 0
+            for chall_id in sorted(self.random.sample(sorted(self.challenges), min(n_solves, len(self.challenges)))):
+                self.solve(idx, chall_id)
+
+    def add_challenge(self, idx) -> dict:
+        chall = {
+            'id_challenge': str(idx),
+            'id_trad': str(idx),
+            'titre': f'Challenge {idx}',
+            'soustitre': f'Synthetic challenge number {idx}',
+            'score': str(self.random.choice(SCORES)),
+            'rubrique': self.random.choice(CATEGORIES),
+            'difficulte': self.random.choice(DIFFICULTIES),
+        }
+        self.challenges[idx] = chall
+        return chall
+
+    def solve(self, user_id, chall_id) -> None:
+        """Add a validation to a user, dated after every previous one"""
+        self.clock += timedelta(minutes=self.random.randint(1, 600))
+        user = self.users[user_id]
+        chall = self.challenges[chall_id]
+        user['validations'].insert(0, {  # the API lists validations from newest to oldest
+            'id_challenge': str(chall_id),
+            'titre': chall['titre'],
+            'id_rubrique': '0',
+            'date': self.clock.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        user['score'] = str(int(user['score']) + int(chall['score']))
+
+    def simulate_activity(self, n_solves) -> int:
+        """Make random users solve `n_solves` new challenges, returns the number actually added"""
+        added = 0
+        for _ in range(n_solves):
+            user_id = self.random.choice(sorted(self.users))
+            solved = {int(v['id_challenge']) for v in self.users[user_id]['validations']}
+            remaining = sorted(self.challenges.keys() - solved)
+            if remaining:
+                self.solve(user_id, self.random.choice(remaining))
+                added += 1
+        return added
+
+    async def delay_and_fail(self):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            if self.random.random() < 0.5:
+                return web.json_response({'error': 'Too Many Requests'}, status=429, headers={'Retry-After': '1'})
+            return web.Response(status=self.random.choice([500, 502, 503]), text='<html>Maintenance</html>', content_type='text/html')
+        return None
+
+    async def challenges_page(self, request):
+        if (error := await self.delay_and_fail()) is not None:
+            return error
+        start = int(request.query.get('debut_challenges', 0))
+        ids = sorted(self.challenges, reverse=self.newest_first)[start:start + PAGE_SIZE]
+        page = [{str(i): {'id_challenge': self.challenges[idx]['id_challenge'], 'titre': self.challenges[idx]['titre']} for i, idx in enumerate(ids)}]
+        base = f'{self.base_url}/challenges?debut_challenges='
+        if start > 0 or start + PAGE_SIZE >= len(self.challenges):
+            page.append({'rel': 'previous', 'href': f'{base}{max(0, start - PAGE_SIZE)}'})
+        if start + PAGE_SIZE < len(self.challenges):
+            page.append({'rel': 'next', 'href': f'{base}{start + PAGE_SIZE}'})
+        return web.json_response(page)
+
+    async def challenge(self, request):
+        if (error := await self.delay_and_fail()) is not None:
+            return error
+        chall = self.challenges.get(int(request.match_info['idx']))
+        if chall is None:
+            return web.json_response([{'error': {'code': 404, 'message': 'Not Found'}}], status=404)
+        return web.json_response([chall])
+
+    async def user(self, request):
+        if (error := await self.delay_and_fail()) is not None:
+            return error
+        user = self.users.get(int(request.match_info['idx']))
+        if user is None:
+            return web.json_response({'error': {'code': 404, 'message': 'Not Found'}}, status=404)
+        return web.json_response(user)
+
+    async def users_by_name(self, request):
+        if (error := await self.delay_and_fail()) is not None:
+            return error
+        name = request.query.get('nom', '').lower()
+        found = [{'id_auteur': u['id_auteur'], 'nom': u['nom']} for u in self.users.values() if name in u['nom'].lower()]
+        if not found:
+            return web.json_response([{'error': {'code': 404, 'message': 'Not Found'}}], status=404)
+        return web.json_response([{str(i): u for i, u in enumerate(found)}])
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/challenges', self.challenges_page)
+        app.router.add_get('/challenges/', self.challenges_page)
+        app.router.add_get('/challenges/{idx:\\d+}', self.challenge)
+        app.router.add_get('/auteurs', self.users_by_name)
+        app.router.add_get('/auteurs/{idx:\\d+}', self.user)
+        return app
+
+    async def start(self, host='127.0.0.1', port=0) -> str:
+        """Start serving in the running loop, returns the base url"""
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://{host}:{port}'
+        return self.base_url
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--challenges', type=int, default=600)
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 429/5xx')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    fake = FakeRootMe(args.challenges, args.users, latency=args.latency, error_rate=args.error_rate)
+    fake.base_url = f'http://127.0.0.1:{args.port}'
+    web.run_app(fake.app(), host='127.0.0.1', port=args.port)
@@ -0,0 +1,74 @@
+"""
+Cost of the hot read paths with full ORM entities against the column-only read models.
+
+    python -m bench.read_models_bench --users 10000 --repeat 20
+
+Fills a fresh database with `users` users, then for each way of reading them
+reports the time per call, the memory allocated at peak during a call and the
+memory the result keeps alive.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy import select
+
+from db_manager import DBManager, User
+
+
+def measure(read, repeat):
+    """(seconds per call, peak bytes allocated by a call, bytes retained by its result)"""
+    read()  # warm up the statement caches
+    start = time.perf_counter()
+    for _ in range(repeat):
+        read()
+    duration = (time.perf_counter() - start) / repeat
+
+    gc.collect()
+    tracemalloc.start()
+    result = read()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return duration, peak, retained
+
+
+def run(args) -> None:
+    rng = random.Random(0)
+    db_file = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    with contextlib.redirect_stdout(io.StringIO()):
+        db = DBManager(db_file)
+        db.newUsers([{'id_auteur': str(idx), 'nom': f'hacker{idx}', 'score': rng.randint(0, 50000), 'validations': []}
+                     for idx in range(1, args.users + 1)])
+    due = rng.sample(range(1, args.users + 1), min(120, args.users))
+
+    paths = [
+        ('all users, ORM (getAllUsers)', db.getAllUsers),
+        ('all users, read model', db.getUserSnapshots),
+        ('polled users, ORM', lambda: db.execute(select(User).where(User.id.in_(due)))),
+        ('polled users, read model', lambda: db.getUserSnapshots(due)),
+        ('scoreboard, ORM sorted', lambda: sorted(db.getAllUsers(), key=lambda u: -u.score)),
+        ('scoreboard, ranking index', db.getScoreboard),
+    ]
+
+    print(f"{args.users} users, {args.repeat} calls per path")
+    print(f"{'path':<32} {'ms/call':>9} {'peak (KiB)':>11} {'kept (KiB)':>11}")
+    for name, read in paths:
+        duration, peak, retained = measure(read, args.repeat)
+        print(f"{name:<32} {duration * 1000:>9.2f} {peak / 1024:>11.0f} {retained / 1024:>11.0f}")
+
+    db.engine.dispose()
+    os.remove(db_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    run(parser.parse_args())
@@ -0,0 +1,131 @@
+"""
+End-to-end benchmark of the synchronisation paths against the local fake Root-Me API.
+
+    python -m bench.sync_bench --challenges 600 --users 300 --latency 0.05 --error-rate 0.01
+
+Runs, on a fresh database:
+  - cold catalog sync (loadAllChallenges on an empty db)
+  - warm catalog sync (nothing changed), then with a few new challenges
+  - registration of every user (loadUser)
+  - solve polling cycles (updateUsers, what cron_check_solves runs), idle then with new solves
+and reports for each: duration, requests sent and requests/s, time spent in the db.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from sqlalchemy import event
+
+from bench.fake_rootme import FakeRootMe
+from rm_api import RootMeAPI
+
+
+class DBTimer():
+    """Accumulates the time spent executing SQL statements on an engine"""
+    def __init__(self, engine) -> None:
+        self.elapsed = 0.0
+        self.queries = 0
+        event.listen(engine, 'before_cursor_execute', self.before)
+        event.listen(engine, 'after_cursor_execute', self.after)
+
+    def before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def after(self, conn, cursor, statement, parameters, context, executemany):
+        self.elapsed += time.perf_counter() - conn.info['query_start'].pop()
+        self.queries += 1
+
+
+class Step():
+    def __init__(self, name, api, db_timer, fake, verbose) -> None:
+        self.name = name
+        self.api = api
+        self.db_timer = db_timer
+        self.fake = fake
+        self.verbose = verbose
+
+    def __enter__(self):
+        self.requests = sum(c['requests'] for c in self.api.stats.values())
+        self.served = self.fake.requests
+        self.db_elapsed, self.queries = self.db_timer.elapsed, self.db_timer.queries
+        self.output = contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+        self.output.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        self.output.__exit__(*exc)
+        requests = sum(c['requests'] for c in self.api.stats.values()) - self.requests
+        db_elapsed = self.db_timer.elapsed - self.db_elapsed
+        queries = self.db_timer.queries - self.queries
+        print(f"{self.name:<32} {duration:>9.2f} {requests:>9} {requests / duration:>10.1f} "
+              f"{self.fake.requests - self.served:>8} {db_elapsed:>8.2f} {queries:>8}")
+
+
+async def run(args) -> None:
+    fake = FakeRootMe(args.challenges, args.users, max_solves=args.max_solves, latency=args.latency,
+                      error_rate=args.error_rate, newest_first=args.newest_first)
+    base_api = await fake.start()
+    db_file = os.path.join(tempfile.mkdtemp(), 'bench.db')
+
+    async with RootMeAPI('bench', base_api=base_api, db_name=db_file) as api:
+        api.rate_limit.rate = args.rate
+        api.rate_limit.capacity = api.rate_limit.tokens = max(1, args.rate)
+        db_timer = DBTimer(api.db.sync.engine)
+
+        print(f"{args.challenges} challenges, {args.users} users, {args.latency * 1000:.0f} ms latency, "
+              f"{args.error_rate:.0%} errors, {args.rate} req/s allowed")
+        print(f"{'step':<32} {'seconds':>9} {'requests':>9} {'req/s':>10} {'served':>8} {'db (s)':>8} {'queries':>8}")
+
+        with Step('cold catalog sync', api, db_timer, fake, args.verbose):
+            await api.loadAllChallenges()
+
+        with Step('warm catalog sync', api, db_timer, fake, args.verbose):
+            await api.loadAllChallenges()
+
+        for idx in range(args.challenges + 1, args.challenges + args.new_challenges + 1):
+            fake.add_challenge(idx)
+        with Step(f'catalog sync, {args.new_challenges} new', api, db_timer, fake, args.verbose):
+            await api.loadAllChallenges()
+
+        with Step('register users', api, db_timer, fake, args.verbose):
+            for idx in fake.users:
+                await api.loadUser(idx=idx)
+
+        users = await api.db.getUserSnapshots()
+        with Step('poll cycle, no new solve', api, db_timer, fake, args.verbose):
+            async for solve in api.updateUsers(users):
+                pass
+
+        for cycle in range(args.cycles):
+            added = fake.simulate_activity(args.solves_per_cycle)
+            found = 0
+            with Step(f'poll cycle, {added} new solves', api, db_timer, fake, args.verbose):
+                async for solve in api.updateUsers(await api.db.getUserSnapshots()):
+                    found += 1
+            if found != added:
+                print(f"  /!\\ {found} solves announced instead of {added}")
+
+    await fake.stop()
+    os.remove(db_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--challenges', type=int, default=600)
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--new-challenges', type=int, default=5, help='challenges published before the second warm catalog sync')
+    parser.add_argument('--max-solves', type=int, default=300, help='maximum number of solves per synthetic user')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 429/5xx')
+    parser.add_argument('--rate', type=float, default=1000, help='client side rate limit (req/s)')
+    parser.add_argument('--cycles', type=int, default=3, help='poll cycles with new solves')
+    parser.add_argument('--solves-per-cycle', type=int, default=10)
+    parser.add_argument('--newest-first', action='store_true', help='list the challenges from the newest one')
+    parser.add_argument('--verbose', action='store_true', help='keep the output of the bot')
+    asyncio.run(run(parser.parse_args()))
@@ -6,10 +6,14 @@ from typing import List, Optional
 from discord.channel import TextChannel
 import traceback
 import datetime
+import time
 
-from db_manager import DBManager
+from db_executor import AsyncDBManager
 from rm_api import RootMeAPI
-from constants import UPDATE_CHALLS_DELAY, UPDATE_SOLVES_DELAY
+from constants import (UPDATE_CHALLS_DELAY, UPDATE_SOLVES_DELAY, SOLVES_MAX_POLL_DELAY, SOLVES_ACTIVITY_RATIO,
+                       SOLVES_POLL_BUDGET, SOLVES_SCHEDULER_TICK)
+from scheduler import PollScheduler
+from latency import LatencyHistogram
 import asyncio
 import utils
 from errors import *
@@ -50,7 +54,7 @@ class CustomBot(commands.Bot):
         self,
         *args,
         initial_extensions: List[str],
-        db_pool: DBManager,
+        db_pool: AsyncDBManager,
         api: RootMeAPI,
         testing_guild_id: Optional[int] = None,
         bot_channel_id: Optional[int] = None,
@@ -63,6 +67,7 @@ class CustomBot(commands.Bot):
         self.bot_channel_id = int(bot_channel_id)
         self.initial_extensions = initial_extensions
         self.init_done = False
+        self.autocomplete_latency = LatencyHistogram()
 
     async def init_db(self) -> None:
         """Checks if the database seems populated or not (first run)"""
@@ -97,7 +102,7 @@ class CustomBot(commands.Bot):
                 # new_challs: liste des nouveaux challenges, au format JSON (fetch depuis l'api)
                 new_challs = await self.api.loadAllChallenges()
                 if len(new_challs):
-                    full_chall_list = [self.db_pool.getChallengeById(x) for x in new_challs]
+                    full_chall_list = [await self.db_pool.getChallengeById(x) for x in new_challs]
                     await utils.new_chall(channel, full_chall_list)
             except Exception:
                 # utils.panic_message(channel, traceback.format_exc())
@@ -106,7 +111,7 @@ class CustomBot(commands.Bot):
             print(f"{datetime.datetime.now()} | OK challs")
 
     async def cron_check_solves(self) -> None:
-        """Checks for new challs"""
+        """Checks for new solves, each user being polled according to their activity"""
 
         await self.wait_until_ready()
         channel = self.get_channel(self.bot_channel_id)
@@ -114,18 +119,38 @@ class CustomBot(commands.Bot):
         while not self.init_done:
             await asyncio.sleep(1)
 
+        scheduler = PollScheduler(UPDATE_SOLVES_DELAY, SOLVES_MAX_POLL_DELAY, SOLVES_ACTIVITY_RATIO, SOLVES_POLL_BUDGET)
         while True:
-            await asyncio.sleep(UPDATE_SOLVES_DELAY)
+            await asyncio.sleep(SOLVES_SCHEDULER_TICK)
+            due = set()
             try:
-                for user in self.db_pool.getAllUsers():
-                    async for solve in self.api.updateUser(user):
-                        await utils.new_solves(channel, solve)
+                # the last solve dates are only read from the db when users were registered or removed
+                if await self.db_pool.getUserIds() != scheduler.tracked():
+                    scheduler.sync({user_id: self.activity_timestamp(day) for user_id, day in (await self.db_pool.getLastSolveDates()).items()})
+                due = set(scheduler.due())
+                if not due:
+                    continue
+
+                users = await self.db_pool.getUserSnapshots(due)
+                active = set()
+                try:
+                    async for solve in self.api.updateUsers(users):
+                        active.add(solve[0].id)
+                        await utils.new_solves(channel, solve, await self.api.avatars.get(solve[0].id))
+                finally:
+                    scheduler.polled(due, active)
             except Exception:
                 # await utils.panic_message(channel, traceback.format_exc())
                 pass
 
-            print(f"{datetime.datetime.now()} | OK solves")
+            print(f"{datetime.datetime.now()} | OK solves ({len(due)} users polled)")
 
+    @staticmethod
+    def activity_timestamp(day: Optional[datetime.date]) -> Optional[float]:
+        """Solves are stored by day, consider they happened at the end of it"""
+        if day is None:
+            return None
+        return min(datetime.datetime.now(), datetime.datetime.combine(day, datetime.time.max)).timestamp()
 
     async def start(self, *args):
         await self.api.loadAllChallenges()
@@ -137,13 +162,9 @@ class CustomBot(commands.Bot):
         current: str,
     ) -> List[app_commands.Choice[str]]:
 
-        if current == '':
-            users = self.db_pool.getAllUsers()
-        else:
-            users = self.db_pool.getUserByName(current)
-
-        choices = [app_commands.Choice(name=u.name, value=u.name) for u in users[:25]]
-        return sorted(choices, key=lambda choice: choice.name.lower())
+        with self.autocomplete_latency.measure():
+            names = await self.db_pool.completeUserNames(current)
+            return [app_commands.Choice(name=name, value=name) for name in names]
 
     async def choose_challenge_autocomplete(
             self,
@@ -151,13 +172,11 @@ class CustomBot(commands.Bot):
         current: str,
     ) -> List[app_commands.Choice[str]]:
 
-        if current == '':
-            challenges =  []
-        else:
-            challenges = self.db_pool.getChallengesByName(current)
-
-        choices = [app_commands.Choice(name=u.title, value=u.title) for u in challenges[:25]]
-        return sorted(choices, key=lambda choice: choice.name.lower())
+        with self.autocomplete_latency.measure():
+            if current == '':
+                return []
+            titles = await self.db_pool.completeChallengeTitles(current)
+            return [app_commands.Choice(name=title, value=title) for title in titles]
 
 
     def add_commands(self):
@@ -178,7 +197,7 @@ class CustomBot(commands.Bot):
         async def who_solved(ctx: commands.Context, name: str):
             name = discord.utils.escape_markdown(name)
             try:
-                chall_name, solvers = self.db_pool.who_solved(name)
+                chall_name, solvers = await self.db_pool.who_solved(name)
             except ChallengeNotFound:
                 await utils.challenge_not_found(ctx, name)
             except FoundMultipleChallenges:
@@ -187,10 +206,30 @@ class CustomBot(commands.Bot):
                 await utils.who_solved_msg(ctx, chall_name, solvers)
 
 
+        @self.hybrid_command(name="rarest", description="challenges solved by the fewest registered users")
+        async def rarest(ctx: commands.Context):
+            challenges = await self.db_pool.getRarestChallenges()
+            await utils.rarest_msg(ctx, challenges)
+
+        @self.hybrid_command(name="latency", description="response times of the autocompletes")
+        async def latency(ctx: commands.Context):
+            await utils.latency_msg(ctx, self.autocomplete_latency)
+
+        @self.hybrid_command(name="api_stats", description="requests sent to the Root-Me API")
+        async def api_stats(ctx: commands.Context):
+            await utils.api_stats_msg(ctx, self.api.requestStats())
+
         @self.hybrid_command(name="sync", description="lol")
         async def sync(ctx: commands.Context):
             await self.sync_guid()
             await ctx.send("Synced !")
+
+        @self.hybrid_command(name="rebuild_stats", description="recompute the per category stats and daily points")
+        @commands.has_permissions(administrator=True)
+        async def rebuild_stats(ctx: commands.Context):
+            await ctx.defer()
+            fixed = await self.db_pool.rebuildStats()
+            await utils.stats_rebuilt_msg(ctx, fixed)
         
         # @self.hybrid_command(name="update_challs", description="on garde ou pas ?")
         # async def update_challs(ctx: commands.context):
@@ -208,18 +247,17 @@ class CustomBot(commands.Bot):
         #     await ctx.defer()
         #     channel = self.get_channel(self.bot_channel_id)
         #     for user in self.db_pool.getAllUsers():
-        #         solves_data = await self.api.updateUser(user)
-        #         if solves_data:
-        #             await utils.new_solves(ctx, solves_data)
+        #         async for solve in self.api.updateUser(user):
+        #             await utils.new_solves(ctx, solve)
         
         @self.hybrid_command(name="scoreboard", description="scoreboard of registered users")
         async def scoreboard(ctx: commands.Context):
-            users = self.db_pool.getAllUsers()
+            users = await self.db_pool.getScoreboard()
             await utils.scoreboard_msg(ctx, users)
 
         @self.hybrid_command(name="today", description="today's scoreboard")
         async def today(ctx: commands.Context):
-            users = self.db_pool.getTodayScoreboard()
+            users = await self.db_pool.getTodayScoreboard()
             await utils.today_msg(ctx, users)
         
         @self.hybrid_command(name="graph", description="plot users score in last N days")
@@ -230,7 +268,7 @@ class CustomBot(commands.Bot):
             elif n_days > max_days:
                 await utils.too_many_days(ctx, max_days)
             else:
-                last_solves = self.db_pool.getLastSolves(n_days)
+                last_solves = await self.db_pool.getLastSolves(n_days)
                 await utils.graph_msg(ctx, last_solves, n_days)
 
         @self.hybrid_command(name="last_solves", description="last solves for a hacker")
@@ -238,14 +276,14 @@ class CustomBot(commands.Bot):
         async def last_solves(ctx: commands.Context, name_or_id: str, n_days: int):
             await ctx.defer()
             name_or_id = discord.utils.escape_markdown(name_or_id)
-            user = self.db_pool.getUserById(name_or_id)
+            user = await self.db_pool.getUserById(name_or_id)
             if not user: 
-                user = self.db_pool.getUserByName(name_or_id)
+                user = await self.db_pool.getUserByName(name_or_id)
             if user:
                 user = user[0]
                 # user_stats = self.db_pool.getStats(user.id)    
-                solves = self.db_pool.getLastSolvesByUser(user.id, n_days)
-                await utils.last_solves_msg(ctx, user, solves, n_days)
+                solves = await self.db_pool.getLastSolvesByUser(user.id, n_days)
+                await utils.last_solves_msg(ctx, user, solves, n_days, await self.api.avatars.get(user.id))
             else:
                 # await ctx.reply(f"User {name} not found in database")
                 await utils.user_not_found_in_db(ctx, name_or_id)
@@ -271,17 +309,47 @@ class CustomBot(commands.Bot):
                 else:
                     await utils.user_not_found(ctx, name_or_id, by_id=False)
 
+        @self.hybrid_command(name="import_users", description="register many users at once, by name or uid")
+        @commands.has_permissions(administrator=True)
+        async def import_users(ctx: commands.Context, names_or_ids: Optional[str] = None, file: Optional[discord.Attachment] = None):
+            await ctx.defer()
+            # comma separated in the command, one per line in the attached file
+            entries = (names_or_ids or '').split(',')
+            if file is not None:
+                entries += (await file.read()).decode(errors='replace').splitlines()
+            entries = [entry.strip() for entry in entries if entry.strip()]
+            if not entries:
+                await utils.nothing_to_import_msg(ctx)
+                return
+
+            message = await utils.import_progress_msg(ctx, 0, len(entries))
+            last_update = 0
+
+            async def progress(done, total):
+                nonlocal last_update
+                # Discord rate limits message edits
+                if done == total or time.monotonic() - last_update > 2:
+                    last_update = time.monotonic()
+                    await utils.import_progress_msg(ctx, done, total, message)
+
+            report = await self.api.loadUsers(entries, progress)
+            await utils.import_report_msg(ctx, report)
+
         @self.hybrid_command(name="remove_user", description="remove a user from db")
         @app_commands.autocomplete(name_or_id=self.choose_user_autocomplete)
         async def remove_user(ctx: commands.Context, name_or_id: str):
             name_or_id = discord.utils.escape_markdown(name_or_id)
-            user = self.db_pool.getUserById(name_or_id)
-            if not user:
-                user = self.db_pool.getUserByName(name_or_id)
-            if user:
-                user = user[0]
-                self.db_pool.deleteUserByName(user.name)
-                await utils.removed_ok(ctx, user.name)
+
+            def remove(db):
+                """Find and delete the user in one transaction, returns its name"""
+                user = db.getUserById(name_or_id) or db.getUserByName(name_or_id)
+                if user:
+                    db.deleteUserByName(user[0].name)
+                    return user[0].name
+
+            name = await self.db_pool.transaction(remove)
+            if name:
+                await utils.removed_ok(ctx, name)
             else:
                 # await ctx.reply(f"User {input} not found in database")
                 await utils.user_not_found_in_db(ctx, name_or_id)
@@ -291,13 +359,13 @@ class CustomBot(commands.Bot):
         async def profile(ctx: commands.Context, name_or_id: str):
             await ctx.defer()
             name_or_id = discord.utils.escape_markdown(name_or_id)
-            user = self.db_pool.getUserById(name_or_id)
+            user = await self.db_pool.getUserById(name_or_id)
             if not user: 
-                user = self.db_pool.getUserByName(name_or_id)
+                user = await self.db_pool.getUserByName(name_or_id)
             if user:
                 user = user[0]
-                user_stats = self.db_pool.getStats(user.id)    
-                await utils.profile(ctx, user, user_stats)
+                user_stats = await self.db_pool.getStats(user.id)    
+                await utils.profile(ctx, user, user_stats, await self.api.avatars.get(user.id))
             else:
                 # await ctx.reply(f"User {name} not found in database")
                 await utils.user_not_found_in_db(ctx, name_or_id)
@@ -307,18 +375,18 @@ class CustomBot(commands.Bot):
         async def compare(ctx: commands.Context, input1, input2):
             input1 = discord.utils.escape_markdown(input1)
             input2 = discord.utils.escape_markdown(input2)
-            user1 = self.db_pool.getUserById(input1)
+            user1 = await self.db_pool.getUserById(input1)
             if not user1: 
-                user1 = self.db_pool.getUserByName(input1)
+                user1 = await self.db_pool.getUserByName(input1)
 
-            user2 = self.db_pool.getUserById(input2)
+            user2 = await self.db_pool.getUserById(input2)
             if not user2: 
-                user2 = self.db_pool.getUserByName(input2)
+                user2 = await self.db_pool.getUserByName(input2)
             
             if user1 and user2:
                 user1, user2 = user1[0], user2[0]
-                user1_stats = self.db_pool.getStats(user1.id)
-                user2_stats = self.db_pool.getStats(user2.id)
+                user1_stats = await self.db_pool.getStats(user1.id)
+                user2_stats = await self.db_pool.getStats(user2.id)
                 await utils.compare_graph(ctx, user1, user1_stats, user2, user2_stats)
             else:
                 if not user1:
@@ -338,6 +406,10 @@ class CustomBot(commands.Bot):
             await utils.init_not_done_msg(ctx)
             return
         
+        if isinstance(error, commands.MissingPermissions):
+            await utils.missing_permissions_msg(ctx)
+            return
+
         if isinstance(error, TooManyUsers):
             await utils.too_many_users_msg(ctx, error.name)
             return
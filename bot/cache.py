@@ -0,0 +1,49 @@
+import time
+from collections import OrderedDict
+
+
+class ResponseCache():
+    """
+    In-process cache of the decoded API responses.
+    Entries expire after the TTL of their endpoint, and the least recently used
+    ones are evicted once the raw bodies exceed `max_bytes`.
+    Cached values are shared between callers and must not be mutated.
+    """
+    def __init__(self, max_bytes: int, ttls: dict) -> None:
+        self.max_bytes = max_bytes
+        self.ttls = ttls  # endpoint => TTL in seconds, endpoints without TTL are not cached
+        self.entries = OrderedDict()  # key => (expiration, size, value)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(url, params=None):
+        return url, tuple(sorted((params or {}).items()))
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self.remove(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, key, endpoint, value, size: int) -> None:
+        ttl = self.ttls.get(endpoint)
+        if not ttl or size > self.max_bytes:
+            return
+        self.remove(key)
+        self.entries[key] = (time.monotonic() + ttl, size, value)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def remove(self, key) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
@@ -0,0 +1,53 @@
+import threading
+from typing import NamedTuple
+
+
+class CatalogChallenge(NamedTuple):
+    """Read-only copy of a challenge, with the attribute names of the Challenge model"""
+    id: int
+    title: str
+    subtitle: str
+    score: int
+    category: str
+    difficuly: str
+
+
+class ChallengeCatalog():
+    """
+    In-memory copy of the challenges, indexed by id.
+    The catalog is small and barely changes: new challenges are added one by one
+    as they are stored, and a refresh builds a whole new catalog which the
+    DBManager swaps in at once, so readers never see a half built one.
+    """
+    def __init__(self, challenges=()) -> None:
+        self.lock = threading.Lock()
+        self.by_id = {}
+        for chall in challenges:
+            self._add(CatalogChallenge(*chall))
+
+    def add(self, chall: CatalogChallenge) -> None:
+        with self.lock:
+            self._add(chall)
+
+    def _add(self, chall: CatalogChallenge) -> None:
+        self.by_id[chall.id] = chall
+
+    def get(self, idx):
+        return self.by_id.get(int(idx))
+
+    def get_many(self, ids) -> dict:
+        """id => challenge for the ids of `ids` in the catalog"""
+        with self.lock:
+            return {idx: self.by_id[idx] for idx in map(int, ids) if idx in self.by_id}
+
+    def ids(self) -> set:
+        with self.lock:
+            return set(self.by_id)
+
+    def missing(self, ids) -> set:
+        """Ids of `ids` not in the catalog"""
+        with self.lock:
+            return {idx for idx in map(int, ids) if idx not in self.by_id}
+
+    def __len__(self) -> int:
+        return len(self.by_id)
@@ -1,4 +1,47 @@
 UPDATE_CHALLS_DELAY = 3600
 UPDATE_SOLVES_DELAY = 30
 
-DB_NAME = "main.db"
\ No newline at end of file
+# Number of users polled at the same time by the solves cron
+SOLVES_POLL_WORKERS = 8
+# Each user is polled every (time since their last solve / SOLVES_ACTIVITY_RATIO) seconds,
+# bounded by UPDATE_SOLVES_DELAY and SOLVES_MAX_POLL_DELAY, and no more than
+# SOLVES_POLL_BUDGET users are polled per minute. The scheduler wakes up every SOLVES_SCHEDULER_TICK
+SOLVES_MAX_POLL_DELAY = 3600
+SOLVES_ACTIVITY_RATIO = 24
+SOLVES_POLL_BUDGET = 120
+SOLVES_SCHEDULER_TICK = 5
+
+# Number of users resolved and fetched at the same time by an import
+USERS_IMPORT_WORKERS = 8
+
+# Maximum number of challenge details fetched at the same time during a catalog sync
+CHALLS_SYNC_CONCURRENCY = 10
+# A catalog sync stops at the first listing page already in the db if the listing is newest
+# first, except during the full reconciliation that runs at most every CHALLS_FULL_SYNC_DELAY seconds
+CHALLS_FULL_SYNC_DELAY = 24 * 3600
+
+# Requests per second allowed towards the Root-Me API, shared by the crons and the commands
+API_RATE_LIMIT = 5
+API_RATE_BURST = 10
+# Transient errors (429, 5xx, network errors, non JSON answers) are retried with
+# a jittered exponential backoff, starting at API_BACKOFF_BASE seconds
+API_MAX_RETRIES = 4
+API_BACKOFF_BASE = 0.5
+API_BACKOFF_MAX = 30
+
+# Decoded API responses are kept in memory for a TTL depending on the endpoint
+# (endpoints missing here are never cached), up to API_CACHE_MAX_BYTES of raw bodies
+API_CACHE_TTLS = {
+    '/auteurs': 300,
+    '/auteurs/{id}': 60,
+    '/challenges/{id}': 3600,
+}
+API_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# Resolved avatar urls are cached, users without avatar are checked again sooner
+AVATAR_CACHE_TTL = 24 * 3600
+AVATAR_NEGATIVE_TTL = 3600
+
+DB_NAME = "main.db"
+# Threads running the read queries, writes always go through a single thread
+DB_READ_THREADS = 4
@@ -0,0 +1,51 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from db_manager import DBManager
+
+
+class AsyncDBManager():
+    """
+    Awaitable front of a DBManager, so that no query runs on the event loop.
+    Every DBManager method is available as a coroutine: writes are serialized
+    on a single dedicated thread, reads run concurrently on a pool of threads.
+    Methods answered from memory are run directly on the event loop. The DBManager
+    marks its methods with the `writes` and `in_memory` decorators.
+    The wrapped DBManager stays reachable as `sync`.
+    """
+    def __init__(self, db: DBManager, readers: int) -> None:
+        self.sync = db
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self.readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader')
+
+    def __getattr__(self, name):
+        method = getattr(self.sync, name)
+        if not callable(method):
+            return method
+        access = getattr(method, 'db_access', 'read')
+        executor = self.writer if access == 'write' else self.readers
+
+        if access == 'memory':
+            async def run(*args, **kwargs):
+                return method(*args, **kwargs)
+            return run
+
+        async def run(*args, **kwargs):
+            return await asyncio.get_running_loop().run_in_executor(executor, partial(method, *args, **kwargs))
+        return run
+
+    async def transaction(self, steps, *args, **kwargs):
+        """
+        Run `steps(db, *args, **kwargs)`, a function making several calls to the
+        DBManager `db`, on the writer thread and inside a single unit of work:
+        they share one session and are committed together, or not at all.
+        """
+        def run():
+            with self.sync.unitOfWork():
+                return steps(self.sync, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self.writer, run)
+
+    def close(self) -> None:
+        self.writer.shutdown()
+        self.readers.shutdown()
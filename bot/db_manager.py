@@ -1,13 +1,69 @@
 from typing import List
 from typing import Optional
+from typing import NamedTuple
 
 import sqlalchemy
-from sqlalchemy import Column, Integer, String, Table, ForeignKey, create_engine, select, Date, func, delete, asc, desc
+from sqlalchemy import Column, Integer, String, Table, ForeignKey, create_engine, select, insert, update, Date, func, delete, asc, desc
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, Session
 from datetime import date, timedelta, datetime
-from numpy import cumsum
+from contextlib import contextmanager
+import threading
+import numpy as np
 
 from errors import *
+import migrations
+import search
+from ranking import RankingIndex
+from autocomplete import AutocompleteIndex
+from catalog import ChallengeCatalog, CatalogChallenge
+
+# Materialized data checked and recomputed by DBManager.rebuildStats, kept apart from the migrations
+# which backfilled the same tables: table => (key columns, value columns, query of the rows the
+# table should hold, statements recomputing it)
+MATERIALIZED = {
+    "category_totals": (
+        "category", "total",
+        "SELECT category AS category, count(*) AS total FROM challenges GROUP BY category",
+        ["DELETE FROM category_totals",
+         "INSERT INTO category_totals (category, total) SELECT category, count(*) FROM challenges GROUP BY category"],
+    ),
+    "user_category_stats": (
+        "user_id, category", "solved, points",
+        """SELECT solves.user_id AS user_id, challenges.category AS category, count(*) AS solved, sum(challenges.score) AS points
+           FROM solves JOIN challenges ON challenges.id = solves.challenge_id
+           GROUP BY solves.user_id, challenges.category""",
+        ["DELETE FROM user_category_stats",
+         """INSERT INTO user_category_stats (user_id, category, solved, points)
+            SELECT solves.user_id, challenges.category, count(*), sum(challenges.score)
+            FROM solves JOIN challenges ON challenges.id = solves.challenge_id
+            GROUP BY solves.user_id, challenges.category"""],
+    ),
+    "daily_points": (
+        "user_id, day", "points, solves",
+        """SELECT solves.user_id AS user_id, solves.date AS day, sum(challenges.score) AS points, count(*) AS solves
+           FROM solves JOIN challenges ON challenges.id = solves.challenge_id
+           GROUP BY solves.user_id, solves.date""",
+        ["DELETE FROM daily_points",
+         """INSERT INTO daily_points (user_id, day, points, solves)
+            SELECT solves.user_id, solves.date, sum(challenges.score), count(*)
+            FROM solves JOIN challenges ON challenges.id = solves.challenge_id
+            GROUP BY solves.user_id, solves.date"""],
+    ),
+    "challenges": (
+        "id", "solve_count, first_solver",
+        """SELECT id AS id,
+                  (SELECT count(*) FROM solves WHERE solves.challenge_id = challenges.id) AS solve_count,
+                  (SELECT solves.user_id FROM solves WHERE solves.challenge_id = challenges.id
+                   ORDER BY solves.date, solves.rowid LIMIT 1) AS first_solver
+           FROM challenges""",
+        ["""UPDATE challenges SET
+            solve_count = (SELECT count(*) FROM solves WHERE solves.challenge_id = challenges.id),
+            first_solver = (SELECT solves.user_id FROM solves WHERE solves.challenge_id = challenges.id
+                            ORDER BY solves.date, solves.rowid LIMIT 1)"""],
+    ),
+}
+
 
 class Base(DeclarativeBase):
     pass
@@ -46,18 +102,149 @@ class Challenge(Base):
     score: Mapped[int]
     category: Mapped[str]
     difficuly: Mapped[str]
+    # registered users who solved the challenge, and the first of them
+    solve_count: Mapped[int] = mapped_column(default=0, server_default="0")
+    first_solver: Mapped[Optional[int]] = mapped_column(ForeignKey("users.id"))
     users: Mapped[List["Solve"]] = relationship(back_populates="challenge")
     def __repr__(self) -> str:
         return f"Challenge(id={self.id!r}, title={self.title!r}, subtitle={self.subtitle!r}, score={self.score!r}, category={self.category!r}, difficuly={self.difficuly!r})"
     
+
+class SyncState(Base):
+    """Key/value store for the bookkeeping of the synchronisation jobs"""
+    __tablename__ = "sync_state"
+    key: Mapped[str] = mapped_column(primary_key=True)
+    value: Mapped[str]
+
+    def __repr__(self) -> str:
+        return f"SyncState(key={self.key!r}, value={self.value!r})"
+
+
+class UserCategoryStats(Base):
+    """Challenges solved and points earned by a user in a category, kept up to date by the ingestion"""
+    __tablename__ = "user_category_stats"
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    category: Mapped[str] = mapped_column(primary_key=True)
+    solved: Mapped[int]
+    points: Mapped[int]
+
+    def __repr__(self) -> str:
+        return f"UserCategoryStats(user_id={self.user_id!r}, category={self.category!r}, solved={self.solved!r}, points={self.points!r})"
+
+
+class CategoryTotal(Base):
+    """Number of challenges of a category, kept up to date by the catalog sync"""
+    __tablename__ = "category_totals"
+    category: Mapped[str] = mapped_column(primary_key=True)
+    total: Mapped[int]
+
+    def __repr__(self) -> str:
+        return f"CategoryTotal(category={self.category!r}, total={self.total!r})"
+
+
+class DailyPoints(Base):
+    """Points earned and challenges solved by a user on a day, kept up to date by the ingestion"""
+    __tablename__ = "daily_points"
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    day: Mapped[Date] = mapped_column(Date(), primary_key=True)
+    points: Mapped[int]
+    solves: Mapped[int]
+
+    def __repr__(self) -> str:
+        return f"DailyPoints(user_id={self.user_id!r}, day={self.day!r}, points={self.points!r}, solves={self.solves!r})"
+
+class UserSnapshot(NamedTuple):
+    """
+    Read model of a user: as announced right after one of their solves, in the
+    scoreboard, or polled for new solves
+    """
+    id: int
+    name: str
+    score: int
+
 Users = List[User]
 Challenges = List[Challenge]
 Solves = List[Solve]
 
+# Where the AsyncDBManager runs a method: on the writer thread, directly on the
+# event loop for the answers from memory, or on the reader threads by default
+def writes(method):
+    method.db_access = 'write'
+    return method
+
+def in_memory(method):
+    method.db_access = 'memory'
+    return method
+
 class DBManager():
     def __init__(self, db_name) -> None:
         self.engine = create_engine(f"sqlite:///{db_name}", echo=False)
+        migrations.setup(self.engine)
         Base.metadata.create_all(self.engine)
+        migrations.migrate(self.engine)
+        self.local = threading.local()  # unit of work of each thread
+        self.loadIndexes()
+
+    def loadIndexes(self) -> None:
+        """(Re)build the in-memory indexes from the db, each one replaces the current one at once"""
+        ranking = RankingIndex()
+        ranking.load(self.execute(select(User.id, User.name, User.score)))
+        users_completion = AutocompleteIndex()
+        users_completion.load(self.execute(select(User.id, User.name)))
+        self.ranking, self.users_completion = ranking, users_completion
+        self.refreshCatalog()
+        challenges_completion = AutocompleteIndex()
+        challenges_completion.load((chall.id, chall.title) for chall in self.catalog.by_id.values())
+        self.challenges_completion = challenges_completion
+
+    @contextmanager
+    def unitOfWork(self):
+        """
+        Run several DBManager calls in a single session and transaction.
+        Inside the block, every call made by this thread reuses the session (and
+        its identity map) and only flushes its changes. The whole block is
+        committed at the end, or rolled back if it raises, in which case the
+        in-memory indexes, updated as the calls went, are rebuilt from the db.
+        Nested blocks join the outer one.
+        """
+        if getattr(self.local, 'session', None) is not None:
+            yield self.local.session
+            return
+
+        with Session(self.engine, expire_on_commit=False) as session:
+            self.local.session = session
+            try:
+                yield session
+                session.commit()
+            except BaseException:
+                session.rollback()
+                self.local.session = None
+                self.loadIndexes()
+                raise
+            finally:
+                self.local.session = None
+
+    @contextmanager
+    def session(self):
+        """Session of the running unit of work, or a new one for this call only"""
+        if getattr(self.local, 'session', None) is not None:
+            yield self.local.session
+            return
+        with Session(self.engine) as session:
+            yield session
+
+    def commit(self, session) -> None:
+        """Commit, unless a unit of work is running: it commits at its end"""
+        if session is getattr(self.local, 'session', None):
+            session.flush()
+        else:
+            session.commit()
+
+    @writes
+    def refreshCatalog(self) -> None:
+        """Reload the in-memory catalog from the db, the new one replaces the current one at once"""
+        self.catalog = ChallengeCatalog(self.execute(
+            select(Challenge.id, Challenge.title, Challenge.subtitle, Challenge.score, Challenge.category, Challenge.difficuly)))
 
     def getUserById(self, idx) -> User:
         x = self.execute(select(User).where(User.id == idx))
@@ -69,135 +256,237 @@ class DBManager():
         else:
             raise Exception(f"Database corrupted: multiple users with id {idx}")
         
-    def getUserByName(self, name) -> User:
-        with Session(self.engine) as session:
-            x = session.scalars(select(User).where(User.name.ilike(f"%{name}%"))).all()
+    def getUserByName(self, name, limit=None) -> Users:
+        """Users whose name contains `name`, accents and case ignored, the exact match first then by relevance"""
+        with self.session() as session:
+            x = session.scalars(
+                select(User).join(search.users_fts, search.users_fts.c.rowid == User.id)
+                .where(search.matches(search.users_fts, name))
+                .order_by(desc(search.users_fts.c.name == search.normalize(name)), search.rank(search.users_fts, name), User.name)
+                .limit(limit)
+            ).all()
         return x
     
     def getChallengeByName(self, name) -> Challenge:
-        with Session(self.engine) as session:
-            x = session.scalars(select(Challenge).where(Challenge.title.ilike(f"%{name}%"))).all()
+        with self.session() as session:
+            x = self.findChallenge(session, name)
+        return x
+
+    def findChallenge(self, session, name) -> Challenge:
+        """
+        The challenge whose title contains `name`, accents and case ignored. When several do,
+        the one whose title is exactly `name`, else raises FoundMultipleChallenges.
+        """
+        x = self.searchChallenges(session, name, column_name="title")
+        exact = [chall for chall in x if search.normalize(chall.title) == search.normalize(name)]
         if len(x) == 1:
             return x[0]
+        elif len(exact) == 1:
+            return exact[0]
         elif len(x) == 0:
             raise ChallengeNotFound(name, name=name)
         else:
             raise FoundMultipleChallenges(name, name=name)
-        
-    def getChallengesByName(self, name) -> Challenge:
-        with Session(self.engine) as session:
-            x = session.scalars(select(Challenge).where(Challenge.title.ilike(f"%{name}%"))).all()
+
+    def searchChallenges(self, session, name, column_name=None, limit=None) -> Challenges:
+        """Challenges whose title or subtitle (or only `column_name`) contains `name`, accents and case ignored, by relevance"""
+        return session.scalars(
+            select(Challenge).join(search.challenges_fts, search.challenges_fts.c.rowid == Challenge.id)
+            .where(search.matches(search.challenges_fts, name, column_name))
+            # a match in the title is worth more than one in the subtitle
+            .order_by(search.rank(search.challenges_fts, name, 10.0, 1.0), Challenge.title)
+            .limit(limit)
+        ).all()
+
+    def getChallengesByName(self, name, limit=None) -> Challenges:
+        with self.session() as session:
+            x = self.searchChallenges(session, name, limit=limit)
         return x
         
+    @in_memory
+    def completeUserNames(self, text, limit=25) -> List[str]:
+        """Names of the users containing `text` for the autocompletes, read from memory"""
+        return self.users_completion.complete(text, limit)
+
+    @in_memory
+    def completeChallengeTitles(self, text, limit=25) -> List[str]:
+        """Titles of the challenges containing `text` for the autocompletes, read from memory"""
+        return self.challenges_completion.complete(text, limit)
+
     def getAllUsers(self) -> Users:
-        with Session(self.engine) as session:
+        with self.session() as session:
             x = session.scalars(select(User)).all()
         return x
     
+    def getUserSnapshots(self, ids=None) -> List[UserSnapshot]:
+        """Id, name and score of the users (all of them or those of `ids`), read without building ORM objects"""
+        stmt = select(User.id, User.name, User.score)
+        if ids is not None:
+            stmt = stmt.where(User.id.in_(list(ids)))
+        with self.session() as session:
+            x = [UserSnapshot(*row) for row in session.execute(stmt)]
+        return x
+
+    @in_memory
+    def getScoreboard(self):
+        """Registered users from the best to the last, read from the ranking index"""
+        return [UserSnapshot(idx, name, score) for idx, name, score in self.ranking.scoreboard()]
+
+    @in_memory
+    def getUserIds(self) -> set:
+        """Ids of the registered users, read from the ranking index"""
+        with self.ranking.lock:
+            return set(self.ranking.users)
+
+    def getUserSyncState(self, user_id):
+        """
+        (score, number of solves, date of the last solve, last observed API state) of a user,
+        None if the user is not in the db
+        """
+        observed = select(SyncState.value).where(SyncState.key == f"user:{user_id}:observed").scalar_subquery()
+        with self.session() as session:
+            x = session.query(User.score, func.count(Solve.challenge_id), func.max(Solve.date), observed).outerjoin(Solve, Solve.user_id == User.id).filter(User.id == user_id).group_by(User.id).first()
+        return x
+
+    @writes
+    def setObservedStates(self, states: dict) -> None:
+        """
+        Remember the API state ("score,number of validations") of users, only for those who have as many
+        solves in the db as validations in the API: the others still miss a solve.
+        """
+        with self.session() as session:
+            counts = dict(session.execute(select(Solve.user_id, func.count()).where(Solve.user_id.in_(list(states))).group_by(Solve.user_id)).all())
+        self.setSyncState({f"user:{user_id}:observed": state for user_id, state in states.items()
+                           if counts.get(user_id, 0) == int(state.split(',')[1])})
+
+    def getLastSolveDates(self) -> dict:
+        """Date of the last solve of every user, None for users without any solve"""
+        with self.session() as session:
+            x = session.query(User.id, func.max(Solve.date)).outerjoin(Solve, Solve.user_id == User.id).group_by(User.id).all()
+        return dict(x)
+
     def getTodayScoreboard(self):
-        with Session(self.engine) as session:
-            # x = session.query(User.name, func.sum(Challenge.score)).join(Solve, Solve.user_id == User.id).join(Challenge, Solve.challenge_id == Challenge.id).filter(func.date(Solve.date) == date.today()).group_by(User.name).all()
-            x = session.query(User.name, func.sum(Challenge.score)).join(Solve, Solve.user_id == User.id).join(Challenge, Solve.challenge_id == Challenge.id).filter(Solve.date == date.today()).group_by(User.name).all()
+        with self.session() as session:
+            x = session.query(User.name, DailyPoints.points).join(DailyPoints, DailyPoints.user_id == User.id).filter(DailyPoints.day == date.today()).order_by(User.name).all()
         return x
     
     def getLastSolvesByUser(self, user_id, n_days):
         start = date.today() - timedelta(days=n_days)
-        with Session(self.engine) as session:
+        with self.session() as session:
             user_last_solves = session.query(Solve.date, Challenge.title, Challenge.score).join(User, Solve.user_id == User.id).filter(Solve.challenge_id == Challenge.id).filter(User.id == user_id).filter(Solve.date >= start).order_by(desc(Solve.date)).all()
             return user_last_solves
 
     
-    def getLastSolves(self, n_days):
-        users_cum_score = []  # list of tuples, of the form (username, [cumulated earned points])
+    def getLastSolves(self, n_days, top=10):
+        """
+        Points earned day by day over the last n_days by the `top` users who earned the most,
+        as a list of (username, [cumulated earned points]) sorted by points earned
+        """
         start = date.today() - timedelta(days=n_days)
-        users = self.getAllUsers()
-        with Session(self.engine) as session:
-            for u in users:
-                solves_by_day = [0] * (n_days + 2)
-                user_last_solves = session.query(Solve.date, Challenge.score).join(User, Solve.user_id == User.id).filter(Solve.challenge_id == Challenge.id).filter(User.id == u.id).filter(Solve.date >= start).order_by(asc(Solve.date)).all()
-                for day, score in user_last_solves:
-                    solves_by_day[(day-start).days+1] += score
-                cumsolves = cumsum(solves_by_day).tolist()
-                if cumsolves[-1] != 0:
-                    users_cum_score.append((u.name, cumsum(solves_by_day).tolist()))
-        return sorted(users_cum_score, key=lambda el: el[1][-1], reverse=True)[:10]
-        
-    def getChallengeById(self, chall_id) -> Challenge:
-        x = self.execute(select(Challenge).where(Challenge.id == chall_id))
-        if len(x) == 1:
-            return x[0][0]
-        elif len(x) == 0:
-            return None
-        else:
-            raise Exception(f"Database corrupted: multiple challenges with id {chall_id}")
+        with self.session() as session:
+            points_by_day = session.execute(
+                select(DailyPoints.user_id, DailyPoints.day, DailyPoints.points).where(DailyPoints.day >= start)
+            ).all()
+            if not points_by_day:
+                return []
+
+            user_ids, days, points = zip(*points_by_day)
+            users, rows = np.unique(np.array(user_ids), return_inverse=True)
+            columns = (np.array(days, dtype='datetime64[D]') - np.datetime64(start, 'D')).astype(np.int64) + 1
+            earned = np.zeros((len(users), n_days + 2), dtype=np.int64)
+            earned[rows, columns] = points
+            cumulated = earned.cumsum(axis=1)
+
+            totals = cumulated[:, -1]
+            best = np.argpartition(-totals, top - 1)[:top] if len(users) > top else np.arange(len(users))
+            best = best[np.lexsort((users[best], -totals[best]))]
+            best = best[totals[best] != 0]
+            names = dict(session.execute(select(User.id, User.name).where(User.id.in_(users[best].tolist()))).all())
+        return [(names[int(users[i])], cumulated[i].tolist()) for i in best]
+
+    @in_memory
+    def getChallengeById(self, chall_id) -> CatalogChallenge:
+        return self.catalog.get(chall_id)
     
-    def getChallengeByIdBatch(self, ids):
-        return self.execute(select(Challenge).where(Challenge.id.in_(ids)))
+    @in_memory
+    def getChallengeIds(self) -> set:
+        return self.catalog.ids()
+
+    @in_memory
+    def getMissingChallengeIds(self, ids) -> set:
+        """Ids among `ids` of the challenges which are not in the db"""
+        return self.catalog.missing(ids)
 
+    @writes
     def deleteUserByName(self, name):
-        with Session(self.engine) as session:
+        with self.session() as session:
             user_to_delete = session.scalar(select(User).where(User.name == name))
-            for solve in user_to_delete.challenges:
-                session.delete(solve)
-            
+            user_id = user_to_delete.id
+            chall_ids = session.scalars(select(Solve.challenge_id).where(Solve.user_id == user_id)).all()
+            session.execute(delete(UserCategoryStats).where(UserCategoryStats.user_id == user_id))
+            session.execute(delete(DailyPoints).where(DailyPoints.user_id == user_id))
+            session.execute(delete(Solve).where(Solve.user_id == user_id))
+            session.execute(delete(SyncState).where(SyncState.key == f"user:{user_id}:observed"))
+            self.refreshChallengeSolvers(session, chall_ids)
             session.delete(user_to_delete)
-            session.commit()
+            self.commit(session)
+            self.ranking.remove(user_id)
+            self.users_completion.remove(user_id)
 
-    def new_solves(self, user_id, api_solves):
-        for api_solve in api_solves:
-            data_new_solve = self.add_solve_to_user(user_id, api_solve)
-            if data_new_solve is not None:  # There is a new solve
-                yield data_new_solve
-
-    def add_solve_to_user(self, user_id, api_solve):
-        # TODO: manage transition to the next hundred or thousand
+    @writes
+    def add_solves_to_user(self, user_id, api_solves):
+        """
+        Ingest a batch of validations of a user, sorted from oldest to newest, in a single transaction.
+        Returns the announcements of the new solves, as (user, challenge, next user name, points to next,
+        first blood, overtaken user names, milestone) tuples, and the validations whose challenge is not
+        in the db yet.
+        """
         # TODO: cleared category
-        with Session(self.engine) as session:
+        api_solves = list(api_solves)
+        chall_ids = {int(api_solve["id_challenge"]) for api_solve in api_solves}
+        with self.session() as session:
             session.expire_on_commit = False
-            user = session.scalar(select(User).where(User.id == user_id))
-            all_users = sorted(self.getAllUsers(), key=lambda u: u.score)
-            db_solves_id = session.scalars(select(Solve.challenge_id).where(Solve.user_id == user_id)).all()
-            if int(api_solve["id_challenge"]) in db_solves_id:
-                return None  # challenge already solved by the user
-            
-            chall_obj = self.getChallengeById(api_solve["id_challenge"])
-            if chall_obj is None:  # challenge not yet in db => return it
-                return api_solve
-            chall_obj = session.merge(chall_obj)
-            print(f"new challenge solved by user {user_id}: {api_solve['titre']}")
-            print(f"Adding solved challenge {chall_obj.title}")
-            first_blood = (len(chall_obj.users) == 0)
-            solve = Solve(user_id=user_id, date=datetime.strptime(api_solve['date'], "%Y-%m-%d %H:%M:%S"))
-            session.add(solve)
-            solve.challenge = chall_obj
-
-            user.challenges.append(solve)
-            next_users = [u for u in all_users if u.score > user.score]
-            # Check for new completed step
-            step = self.completed_step(user.score, chall_obj.score)
-            user.score += chall_obj.score
-            overtakens = []
-            if not next_users:
-                #  He is the first in the scoreboard
-                data_new_solve = (user, chall_obj, None, None, first_blood, overtakens, step)
-            else:
-                while user.score > next_users[0].score:
-                    overtakens.append(next_users[0].name)
-                    next_users.pop(0)
-                    if len(next_users) == 0:
-                        next_user_name = None
-                        points_to_next = None
-                        break
-                if next_users:
-                    next_user = next_users[0]
-                    points_to_next = next_user.score - user.score
-                    next_user_name = next_user.name
-                data_new_solve = (user, chall_obj, next_user_name, points_to_next, first_blood, overtakens, step)
-
-            session.add(solve)
-            session.commit()
-            return data_new_solve
-        
+            user = session.get(User, user_id)
+            if user is None or not api_solves:
+                return [], []
+
+            solved = set(session.scalars(select(Solve.challenge_id).where(Solve.user_id == user_id).where(Solve.challenge_id.in_(chall_ids))))
+            challenges = {c.id: c for c in session.scalars(select(Challenge).where(Challenge.id.in_(chall_ids)))}
+
+            announcements, missing, new_rows = [], [], []
+            score = user.score
+            for api_solve in api_solves:
+                chall_id = int(api_solve["id_challenge"])
+                if chall_id in solved:
+                    continue  # challenge already solved by the user
+                chall = challenges.get(chall_id)
+                if chall is None:  # challenge not yet in db => return it
+                    missing.append(api_solve)
+                    continue
+
+                print(f"new challenge solved by user {user_id}: {chall.title}")
+                solved.add(chall_id)
+                new_rows.append({"user_id": user_id, "challenge_id": chall_id, "date": datetime.strptime(api_solve['date'], "%Y-%m-%d %H:%M:%S").date()})
+                first_blood = chall.solve_count == 0
+                chall.solve_count += 1
+                if chall.first_solver is None:
+                    chall.first_solver = user_id
+
+                # Check for new completed step
+                step = self.completed_step(score, chall.score)
+                old_score, score = score, score + chall.score
+                overtakens, next_user_name, points_to_next = self.ranking.overtakes(user_id, old_score, score)
+                announcements.append((UserSnapshot(user.id, user.name, score), chall, next_user_name, points_to_next, first_blood, overtakens, step))
+
+            if new_rows:
+                session.execute(insert(Solve), new_rows)
+                self.addCategoryStats(session, user_id, [challenges[row["challenge_id"]] for row in new_rows])
+                self.addDailyPoints(session, user_id, [(row["date"], challenges[row["challenge_id"]].score) for row in new_rows])
+                user.score = score
+                self.commit(session)
+                self.ranking.set(user.id, user.name, score)
+        return announcements, missing
+
     def completed_step(self, user_score, chall_score):
         """
         Check for completed steps during chall validation
@@ -213,75 +502,186 @@ class DBManager():
         return step
     
     def who_solved(self, name):
-        with Session(self.engine) as session:
-            x = session.scalars(select(Challenge).where(Challenge.title.ilike(name))).all()
-            if len(x) == 0:
-                raise ChallengeNotFound(name, name=name)
-            elif len(x) > 1:
-                raise FoundMultipleChallenges(name, name=name)
-            
-            chall = x[0]
-            solvers = []
-            for s in chall.users:
-                date = self.execute(select(Solve.date).where(Solve.challenge_id == select(Challenge.id).where(Challenge.title == chall.title)).where(Solve.user_id == select(User.id).where(User.name == s.user.name)))[0][0]
-                solvers.append((s.user, date))
-        return chall.title, solvers
+        """Title of the challenge matching `name` (see findChallenge) and its solvers, as (user, date) from the last to the first"""
+        with self.session() as session:
+            chall = self.findChallenge(session, name)
+            solvers = session.execute(
+                select(User, Solve.date).join(Solve, Solve.user_id == User.id)
+                .where(Solve.challenge_id == chall.id)
+                .order_by(desc(Solve.date), User.name)
+            ).all()
+        return chall.title, [tuple(solver) for solver in solvers]
+
+    def getRarestChallenges(self, limit=10):
+        """Challenges solved by the fewest registered users (at least one), with the name of their first solver"""
+        with self.session() as session:
+            x = session.execute(
+                select(Challenge, User.name).join(User, User.id == Challenge.first_solver)
+                .where(Challenge.solve_count > 0)
+                .order_by(Challenge.solve_count, Challenge.id)
+                .limit(limit)
+            ).all()
+        return [tuple(row) for row in x]
+
+    def refreshChallengeSolvers(self, session, chall_ids=None):
+        """Recompute solve_count and first_solver of some challenges (all by default) within the caller's transaction"""
+        first_solver = (select(Solve.user_id).where(Solve.challenge_id == Challenge.id)
+                        .order_by(Solve.date, sqlalchemy.literal_column("solves.rowid")).limit(1))
+        stmt = update(Challenge).values(
+            solve_count=select(func.count()).where(Solve.challenge_id == Challenge.id).scalar_subquery(),
+            first_solver=first_solver.scalar_subquery()).execution_options(synchronize_session=False)
+        if chall_ids is not None:
+            stmt = stmt.where(Challenge.id.in_(chall_ids))
+        session.execute(stmt)
 
     def getStats(self, user_id):
-        with Session(self.engine) as session:
-            user_stats = session.query(Challenge.category, func.count(Challenge.id), func.sum(Challenge.score)).join(Solve, Challenge.id == Solve.challenge_id).filter(Solve.user_id == user_id).group_by(Challenge.category).all()
-            global_stats = session.query(Challenge.category, func.count(Challenge.id)).group_by(Challenge.category).all()
-
-        res = {category: {} for category,_ in global_stats}
-        for category, tot_chall in global_stats:
-            try:
-                solved_chall = next((solved_chall for chall, solved_chall, points in user_stats if chall == category), None)
-                points = next((points for chall, solved_chall, points in user_stats if chall == category), None)
-                rate = round(solved_chall/tot_chall*100)
-                res[category].update({"tot_chall" : tot_chall, 
-                                    "solved_chall" : solved_chall,
-                                    "points" : points,
-                                    "rate" : rate})
-            except TypeError: 
-                res[category].update({"tot_chall" : tot_chall, 
-                                    "solved_chall" : 0,
-                                    "points" : 0,
-                                    "rate" : 0})
+        """Solved challenges, points and completion rate of a user in every category"""
+        with self.session() as session:
+            x = session.execute(
+                select(CategoryTotal.category, CategoryTotal.total, UserCategoryStats.solved, UserCategoryStats.points)
+                .outerjoin(UserCategoryStats, (UserCategoryStats.category == CategoryTotal.category) & (UserCategoryStats.user_id == user_id))
+                .order_by(CategoryTotal.category)
+            ).all()
+
+        res = {}
+        for category, tot_chall, solved_chall, points in x:
+            solved_chall = solved_chall or 0
+            res[category] = {"tot_chall" : tot_chall,
+                             "solved_chall" : solved_chall,
+                             "points" : points or 0,
+                             "rate" : round(solved_chall/tot_chall*100)}
         return res
-    
-    def execute(self, stmt: sqlalchemy.sql.expression.Select) -> sqlalchemy.engine.CursorResult:
-        with Session(self.engine) as session:
-            x = session.execute(stmt).all()
-        return x
-    
-    async def newUser(self, user_data):
-        if self.getUserById(user_data['id_auteur']) is not None:
+
+    def addCategoryStats(self, session, user_id, challenges):
+        """Count new solves of `challenges` by a user in the per category stats, within the caller's transaction"""
+        stats = {}
+        for chall in challenges:
+            solved, points = stats.get(chall.category, (0, 0))
+            stats[chall.category] = (solved + 1, points + int(chall.score))
+        if not stats:
             return
 
-        with Session(self.engine) as session:
-            user = User(
-                id = user_data['id_auteur'],
-                score = user_data['score'],
-                name = user_data['nom'],
-                challenges = []
-            )
+        stmt = sqlite_insert(UserCategoryStats)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[UserCategoryStats.user_id, UserCategoryStats.category],
+            set_={"solved": UserCategoryStats.solved + stmt.excluded.solved,
+                  "points": UserCategoryStats.points + stmt.excluded.points})
+        session.execute(stmt, [{"user_id": user_id, "category": category, "solved": solved, "points": points}
+                               for category, (solved, points) in stats.items()])
+
+    def addDailyPoints(self, session, user_id, solves):
+        """Count new solves of a user, as (day, challenge score), in the daily points within the caller's transaction"""
+        days = {}
+        for day, score in solves:
+            points, solved = days.get(day, (0, 0))
+            days[day] = (points + int(score), solved + 1)
+        if not days:
+            return
 
-            for chall in user_data['validations']:
-                chall_obj = self.getChallengeById(chall['id_challenge'])
-                if chall_obj is None:
-                    raise Exception(f"Challenge {chall} solved by {user} doesn't exist in db")
-                print(f"Adding solved challenge {chall_obj.title}")
-                
-                solve = Solve(date=datetime.strptime(chall['date'], "%Y-%m-%d %H:%M:%S"))
-                solve.challenge = chall_obj
+        stmt = sqlite_insert(DailyPoints)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DailyPoints.user_id, DailyPoints.day],
+            set_={"points": DailyPoints.points + stmt.excluded.points,
+                  "solves": DailyPoints.solves + stmt.excluded.solves})
+        session.execute(stmt, [{"user_id": user_id, "day": day, "points": points, "solves": solved}
+                               for day, (points, solved) in days.items()])
 
-                user.challenges.append(solve)
+    @writes
+    def rebuildStats(self) -> dict:
+        """
+        Check the per category stats, the daily points and the solvers of the challenges against
+        the solves and the challenges, and recompute the tables which are out of date.
+        Returns the number of rows which were wrong, extra or missing in each table.
+        """
+        fixed = {}
+        with self.session() as session:
+            for table, (keys, values, expected, rebuild) in MATERIALIZED.items():
+                wrong = session.execute(sqlalchemy.text(f"SELECT count(*) FROM (SELECT {keys}, {values} FROM {table} EXCEPT {expected})")).scalar()
+                missing = session.execute(sqlalchemy.text(f"SELECT count(*) FROM (SELECT {keys} FROM ({expected}) EXCEPT SELECT {keys} FROM {table})")).scalar()
+                fixed[table] = wrong + missing
+                if fixed[table]:
+                    for stmt in rebuild:
+                        session.execute(sqlalchemy.text(stmt))
+            self.commit(session)
+        return fixed
+
+    def getSyncState(self, key) -> Optional[str]:
+        with self.session() as session:
+            x = session.scalar(select(SyncState.value).where(SyncState.key == key))
+        return x
 
-            session.add_all([user])
-            session.commit()
+    @writes
+    def setSyncState(self, values: dict) -> None:
+        with self.session() as session:
+            for key, value in values.items():
+                session.merge(SyncState(key=key, value=value))
+            self.commit(session)
 
+    def execute(self, stmt: sqlalchemy.sql.expression.Select) -> sqlalchemy.engine.CursorResult:
+        with self.session() as session:
+            x = session.execute(stmt).all()
+        return x
+    
+    @writes
+    def newUser(self, user_data):
+        """
+        Register a user with all their validations, in a bounded number of queries whatever the number
+        of validations. Validations of challenges missing from the db are skipped: RootMeAPI.loadUser
+        loads those challenges beforehand.
+        """
+        self.newUsers([user_data])
+
+    @writes
+    def newUsers(self, users_data) -> list:
+        """
+        Register several users with their validations in a single transaction, see newUser.
+        Users already in the db are left untouched. Returns the names of the users added.
+        """
+        users_data = list({int(user_data['id_auteur']): user_data for user_data in users_data}.values())
+        chall_ids = {int(chall['id_challenge']) for user_data in users_data for chall in user_data['validations']}
+        with self.session() as session:
+            known = set(session.scalars(select(User.id).where(User.id.in_([int(user_data['id_auteur']) for user_data in users_data]))))
+            challenges = self.catalog.get_many(chall_ids)
+            added = [user_data for user_data in users_data if int(user_data['id_auteur']) not in known]
+            scores = [self.insertUser(session, user_data, challenges) for user_data in added]
+            # registered users may have solved a challenge before its current first solver
+            self.refreshChallengeSolvers(session, list(challenges))
+            self.commit(session)
+
+        for user_data, score in zip(added, scores):
+            self.ranking.set(int(user_data['id_auteur']), user_data['nom'], score)
+            self.users_completion.set(int(user_data['id_auteur']), user_data['nom'])
+        return [user_data['nom'] for user_data in added]
+
+    def insertUser(self, session, user_data, challenges) -> int:
+        """
+        Insert a user, their solves and their stats within the caller's transaction, `challenges` maps ids to
+        the solved challenges. Returns the score stored.
+        """
+        user_id = int(user_data['id_auteur'])
+        new_rows, skipped = {}, False
+        for chall in user_data['validations']:
+            chall_id = int(chall['id_challenge'])
+            if chall_id not in challenges:
+                print(f"Challenge {chall['titre']} solved by {user_data['nom']} doesn't exist in db, the solve is ignored")
+                skipped = True
+                continue
+            new_rows[chall_id] = {"user_id": user_id, "challenge_id": chall_id, "date": datetime.strptime(chall['date'], "%Y-%m-%d %H:%M:%S").date()}
+        print(f"Adding {len(new_rows)} solved challenges to {user_data['nom']}")
+
+        # The API score counts the ignored solves, which add their points again once they are ingested
+        score = sum(challenges[chall_id].score for chall_id in new_rows) if skipped else int(user_data['score'])
+        session.add(User(id=user_id, score=score, name=user_data['nom']))
+        session.flush()
+        if new_rows:
+            session.execute(insert(Solve), list(new_rows.values()))
+        self.addCategoryStats(session, user_id, [challenges[chall_id] for chall_id in new_rows])
+        self.addDailyPoints(session, user_id, [(row["date"], challenges[row["challenge_id"]].score) for row in new_rows.values()])
+        return score
+
+    @writes
     def newChallenge(self, chall_data):
-        with Session(self.engine) as session:
+        with self.session() as session:
             chall5 = Challenge(
                 id = chall_data['id_trad'],
                 title = chall_data['titre'].replace("&#8217;", "'").replace("&nbsp;", " ").replace("&amp;", "&"),
@@ -293,7 +693,13 @@ class DBManager():
             )
 
             session.add_all([chall5])
-            session.commit()
+            session.execute(sqlite_insert(CategoryTotal).values(category=chall5.category, total=1)
+                            .on_conflict_do_update(index_elements=[CategoryTotal.category],
+                                                   set_={"total": CategoryTotal.total + 1}))
+            chall = CatalogChallenge(int(chall5.id), chall5.title, chall5.subtitle, int(chall5.score), chall5.category, chall5.difficuly)
+            self.commit(session)
+            self.catalog.add(chall)
+            self.challenges_completion.set(chall.id, chall.title)
 
 
     
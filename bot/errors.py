@@ -28,4 +28,10 @@ class UserNotFound(commands.CommandError):
 class FoundMultipleChallenges(commands.CommandError):
     def __init__(self, message, name):            
         super().__init__(message)
-        self.name = name
\ No newline at end of file
+        self.name = name
+
+class RootMeAPIError(commands.CommandError):
+    def __init__(self, message, url, status=None):
+        super().__init__(message)
+        self.url = url
+        self.status = status
@@ -0,0 +1,53 @@
+import bisect
+import time
+from contextlib import contextmanager
+
+
+class LatencyHistogram():
+    """
+    Counts of durations per bucket, bounded memory whatever the number of samples.
+    Buckets are upper bounds in milliseconds, the last one catches everything above.
+    """
+    # 3000 ms is the deadline of the Discord autocompletes, so that share_under(3000) is exact
+    BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 3000, 5000, float('inf')]
+
+    def __init__(self, buckets=BUCKETS) -> None:
+        self.buckets = list(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.total = 0
+        self.max = 0.0
+
+    def record(self, seconds) -> None:
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.total += 1
+        self.max = max(self.max, ms)
+
+    @contextmanager
+    def measure(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(time.perf_counter() - start)
+
+    def quantile(self, q) -> float:
+        """Upper bound (ms) of the bucket holding the q-quantile, the max for the last bucket"""
+        if not self.total:
+            return 0.0
+        rank, seen = q * self.total, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def share_under(self, ms) -> float:
+        """Share of the samples that took at most `ms`, rounded to the buckets"""
+        if not self.total:
+            return 1.0
+        return sum(count for bound, count in zip(self.buckets, self.counts) if bound <= ms) / self.total
+
+    def summary(self) -> str:
+        return (f"{self.total} calls, p50 {self.quantile(0.5):.2f} ms, p95 {self.quantile(0.95):.2f} ms, "
+                f"p99 {self.quantile(0.99):.2f} ms, max {self.max:.2f} ms")
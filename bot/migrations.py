@@ -0,0 +1,142 @@
+"""
+Versioned schema migrations of the bot database.
+
+The schema version is kept in SQLite's user_version pragma. Tables are created
+from the models by DBManager, then every migration above the current version
+is applied in order and the version is bumped after each one.
+A migration is frozen once released: its SQL is written inline, never shared
+with the code of the bot, so that it does the same on every database.
+Migrations must be idempotent: a fresh database runs all of them right after
+its tables are created, and a migration interrupted midway is run again.
+A migration is a list of SQL statements or of functions taking a connection.
+"""
+from sqlalchemy import event, text
+from sqlalchemy.engine import Connection, Engine
+
+import search
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Applied on every new connection"""
+    cursor = dbapi_connection.cursor()
+    # WAL lets the commands read while the poller writes
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+    # used by the triggers of the search indexes
+    search.register(dbapi_connection)
+
+
+def add_column(table: str, column: str, definition: str):
+    """Migration step adding a column, skipped when the models already created it"""
+    def step(conn: Connection) -> None:
+        columns = [row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+
+MIGRATIONS = [
+    # 1: indexes for the hot queries
+    [
+        # getTodayScoreboard, getLastSolves: range on the date, covering the joined ids
+        "CREATE INDEX IF NOT EXISTS ix_solves_date ON solves (date, user_id, challenge_id)",
+        # getLastSolvesByUser, getUserSyncState, getLastSolveDates
+        "CREATE INDEX IF NOT EXISTS ix_solves_user_date ON solves (user_id, date)",
+        # who_solved, solver counts for first bloods
+        "CREATE INDEX IF NOT EXISTS ix_solves_challenge ON solves (challenge_id, user_id, date)",
+        "CREATE INDEX IF NOT EXISTS ix_users_name ON users (name)",
+        "CREATE INDEX IF NOT EXISTS ix_challenges_title ON challenges (title)",
+        # getStats: per category counts and points
+        "CREATE INDEX IF NOT EXISTS ix_challenges_category ON challenges (category, id, score)",
+    ],
+    # 2: backfill of the materialized per category stats (tables created from the models)
+    [
+        "DELETE FROM category_totals",
+        "INSERT INTO category_totals (category, total) SELECT category, count(*) FROM challenges GROUP BY category",
+        "DELETE FROM user_category_stats",
+        """INSERT INTO user_category_stats (user_id, category, solved, points)
+       SELECT solves.user_id, challenges.category, count(*), sum(challenges.score)
+       FROM solves JOIN challenges ON challenges.id = solves.challenge_id
+       GROUP BY solves.user_id, challenges.category""",
+    ],
+    # 3: daily points rollup for /today and /graph
+    [
+        "CREATE INDEX IF NOT EXISTS ix_daily_points_day ON daily_points (day, user_id, points)",
+        "DELETE FROM daily_points",
+        """INSERT INTO daily_points (user_id, day, points, solves)
+       SELECT solves.user_id, solves.date, sum(challenges.score), count(*)
+       FROM solves JOIN challenges ON challenges.id = solves.challenge_id
+       GROUP BY solves.user_id, solves.date""",
+    ],
+    # 4: solvers counters on the challenges, for first bloods and the rarest challenges
+    [
+        add_column("challenges", "solve_count", "INTEGER NOT NULL DEFAULT 0"),
+        add_column("challenges", "first_solver", "INTEGER REFERENCES users (id)"),
+        """UPDATE challenges SET
+       solve_count = (SELECT count(*) FROM solves WHERE solves.challenge_id = challenges.id),
+       first_solver = (SELECT solves.user_id FROM solves WHERE solves.challenge_id = challenges.id
+                       ORDER BY solves.date, solves.rowid LIMIT 1)""",
+        "CREATE INDEX IF NOT EXISTS ix_challenges_solve_count ON challenges (solve_count, id)",
+    ],
+    # 5: full text search on the challenges and the users
+    [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS challenges_fts USING fts5(title, subtitle, tokenize='trigram')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(name, tokenize='trigram')",
+        """CREATE TRIGGER IF NOT EXISTS challenges_fts_insert AFTER INSERT ON challenges BEGIN
+       INSERT INTO challenges_fts (rowid, title, subtitle) VALUES (new.id, normalize(new.title), normalize(new.subtitle));
+       END""",
+        """CREATE TRIGGER IF NOT EXISTS challenges_fts_update AFTER UPDATE OF id, title, subtitle ON challenges BEGIN
+       DELETE FROM challenges_fts WHERE rowid = old.id;
+       INSERT INTO challenges_fts (rowid, title, subtitle) VALUES (new.id, normalize(new.title), normalize(new.subtitle));
+       END""",
+        """CREATE TRIGGER IF NOT EXISTS challenges_fts_delete AFTER DELETE ON challenges BEGIN
+       DELETE FROM challenges_fts WHERE rowid = old.id;
+       END""",
+        """CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+       INSERT INTO users_fts (rowid, name) VALUES (new.id, normalize(new.name));
+       END""",
+        """CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF id, name ON users BEGIN
+       DELETE FROM users_fts WHERE rowid = old.id;
+       INSERT INTO users_fts (rowid, name) VALUES (new.id, normalize(new.name));
+       END""",
+        """CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+       DELETE FROM users_fts WHERE rowid = old.id;
+       END""",
+        "DELETE FROM challenges_fts",
+        "INSERT INTO challenges_fts (rowid, title, subtitle) SELECT id, normalize(title), normalize(subtitle) FROM challenges",
+        "DELETE FROM users_fts",
+        "INSERT INTO users_fts (rowid, name) SELECT id, normalize(name) FROM users",
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_version(conn: Connection) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def migrate(engine: Engine) -> None:
+    with engine.connect() as conn:
+        version = get_version(conn)
+
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        print(f"Migrating database to version {target}")
+        with engine.begin() as conn:
+            for step in MIGRATIONS[target - 1]:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(text(step))
+            conn.exec_driver_sql(f"PRAGMA user_version = {target}")
+
+    if version < SCHEMA_VERSION:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")  # let the query planner know about the new indexes
+
+
+def setup(engine: Engine) -> None:
+    event.listen(engine, "connect", set_sqlite_pragmas)
@@ -0,0 +1,68 @@
+import threading
+
+from sortedcontainers import SortedList
+
+
+class RankingIndex():
+    """
+    In-memory ranking of the registered users, kept sorted by score.
+    Entries are (-score, user id) tuples so that iterating gives the scoreboard
+    order (best first, ties by id), and every update or lookup is O(log n).
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.entries = SortedList()
+        self.users = {}  # user id => (name, score)
+
+    def load(self, users) -> None:
+        """Replace the index content with `users`, an iterable of (id, name, score)"""
+        with self.lock:
+            self.users = {idx: (name, score) for idx, name, score in users}
+            self.entries = SortedList((-score, idx) for idx, (name, score) in self.users.items())
+
+    def set(self, user_id, name, score) -> None:
+        with self.lock:
+            self._remove(user_id)
+            self.users[user_id] = (name, score)
+            self.entries.add((-score, user_id))
+
+    def remove(self, user_id) -> None:
+        with self.lock:
+            self._remove(user_id)
+
+    def _remove(self, user_id) -> None:
+        if user_id in self.users:
+            _, score = self.users.pop(user_id)
+            self.entries.remove((-score, user_id))
+
+    def overtakes(self, user_id, old_score, new_score):
+        """
+        What a user going from old_score to new_score changes in the ranking:
+        the names of the users passed (lowest score first), and the name of the
+        next user to overtake with the points still needed, or None, None.
+        """
+        with self.lock:
+            # Entries strictly between the two scores are the users passed
+            first_passed = self.entries.bisect_right((-new_score, float('inf')))
+            after_passed = self.entries.bisect_left((-old_score, float('-inf')))
+            passed = sorted((e for e in self.entries[first_passed:after_passed] if e[1] != user_id), key=lambda e: (-e[0], e[1]))
+
+            # The next user is the lowest score at least equal to the new one (strictly above when nothing was gained)
+            above = first_passed if new_score > old_score else after_passed
+            next_entry = None
+            for index in range(above - 1, -1, -1):
+                entry = self.entries[index]
+                if entry[1] == user_id:
+                    continue
+                if next_entry is not None and entry[0] != next_entry[0]:
+                    break
+                next_entry = entry  # keep going back to the smallest id among the ties
+
+            if next_entry is None:
+                return [self.users[idx][0] for _, idx in passed], None, None
+            return [self.users[idx][0] for _, idx in passed], self.users[next_entry[1]][0], -next_entry[0] - new_score
+
+    def scoreboard(self):
+        """[(id, name, score)] from the best user to the last"""
+        with self.lock:
+            return [(idx, self.users[idx][0], -score) for score, idx in self.entries]
@@ -0,0 +1,39 @@
+import asyncio
+import time
+
+
+class TokenBucket():
+    """
+    Client side rate limiter shared by every request sent to the Root-Me API.
+    Tokens are refilled at `rate` per second, up to `capacity` for bursts.
+    """
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        # The lock makes the waiters queue up in order instead of all waking up at once
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, delay: float) -> None:
+        """Hold every caller for `delay` seconds, used when the API sends a Retry-After"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        # refill from the end of the pause, not from before it, so that no burst fires when it ends
+        self.tokens = 0
+        self.updated = self.blocked_until
@@ -1,17 +1,44 @@
 import aiohttp
 import asyncio
+import os
 import json
+import time
+import random
+import re
+from collections import Counter, defaultdict
+from itertools import groupby
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from dotenv import load_dotenv
 from db_manager import DBManager
-from constants import DB_NAME
+from db_executor import AsyncDBManager
+from rate_limit import TokenBucket
+from cache import ResponseCache
+from avatars import AvatarResolver
+from errors import RootMeAPIError
+from constants import (DB_NAME, DB_READ_THREADS, SOLVES_POLL_WORKERS, USERS_IMPORT_WORKERS, CHALLS_SYNC_CONCURRENCY, CHALLS_FULL_SYNC_DELAY,
+                       API_RATE_LIMIT, API_RATE_BURST, API_MAX_RETRIES, API_BACKOFF_BASE, API_BACKOFF_MAX,
+                       API_CACHE_TTLS, API_CACHE_MAX_BYTES, AVATAR_CACHE_TTL, AVATAR_NEGATIVE_TTL)
 
 class RootMeAPI(aiohttp.ClientSession):
 
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, base_api: str = 'https://api.www.root-me.org', db_name: str = DB_NAME):
         super().__init__()
 
-        self.BASE_API = 'https://api.www.root-me.org/'
+        self.BASE_API = base_api.rstrip('/')
         self.api_key = api_key
-        self.db = DBManager(DB_NAME)
+        self.db = AsyncDBManager(DBManager(db_name), DB_READ_THREADS)
+        self.rate_limit = TokenBucket(API_RATE_LIMIT, API_RATE_BURST)
+        self.stats = defaultdict(Counter)
+        self.cache = ResponseCache(API_CACHE_MAX_BYTES, API_CACHE_TTLS)
+        self.inflight = {}  # cache key => pending request, shared by identical concurrent calls
+        self.avatars = AvatarResolver(self, AVATAR_CACHE_TTL, AVATAR_NEGATIVE_TTL)
+        self.challs_loads = asyncio.Semaphore(CHALLS_SYNC_CONCURRENCY)  # challenge details fetched at the same time
+
+    async def close(self):
+        await super().close()
+        self.db.close()
 
     async def fetchChallenge(self, idx):
         chall = await self.fetch(f"{self.BASE_API}/challenges/{idx}")
@@ -19,8 +46,8 @@ class RootMeAPI(aiohttp.ClientSession):
             chall = chall[0]
         return chall
 
-    async def fetchUserById(self, idx):
-        user = await self.fetch(f"{self.BASE_API}/auteurs/{idx}")
+    async def fetchUserById(self, idx, fresh=False):
+        user = await self.fetch(f"{self.BASE_API}/auteurs/{idx}", fresh=fresh)
         if isinstance(user, list):
             user = user[0]
         if "error" in user.keys():
@@ -37,51 +64,132 @@ class RootMeAPI(aiohttp.ClientSession):
             return users
     
     async def updateUser(self, user):
-        user_data = await self.fetchUserById(user.id)
-        api_solves = reversed(user_data["validations"])  # sort from oldest to newest
-        for solve in self.db.new_solves(user.id, api_solves):
-            if isinstance(solve, dict):
-                print(f"Le challenge {solve['titre']} n'existe pas dans la bdd. On l'ajoute...")
-                chall_id = await self.loadChallenge(solve["id_challenge"])
-                if chall_id:
-                    print(f"Le challenge {solve['titre']} a bien été ajouté dans la bdd. On ajoute le solve...")
-                    solve = self.db.add_solve_to_user(user.id, solve)
-            
+        async for solve in self.updateUsers([user]):
             yield solve
-            await asyncio.sleep(0.5)
+
+    async def updateUsers(self, users, workers=SOLVES_POLL_WORKERS):
+        """Poll users, then ingest their new solves in one transaction and yield them in the order they were made"""
+        semaphore = asyncio.Semaphore(workers)
+
+        async def poll(user):
+            async with semaphore:
+                try:
+                    user_data = await self.fetchUserById(user.id, fresh=True)
+                except RootMeAPIError as e:
+                    print(f"Could not poll {user.name}: {e}")
+                    return user.id, None, []
+            if not user_data:
+                return user.id, None, []
+            return (user.id, *await self.pendingValidations(user.id, user_data))
+
+        polled = await asyncio.gather(*(poll(user) for user in users))
+        observed = {user_id: state for user_id, state, _ in polled if state is not None}
+        if not observed:
+            return
+        # Dates are formatted as "%Y-%m-%d %H:%M:%S", ties are broken by user then challenge
+        new_solves = sorted(((user_id, solve) for user_id, _, validations in polled for solve in validations),
+                            key=lambda s: (s[1]['date'], s[0], int(s[1]['id_challenge'])))
+
+        # Missing challenges are loaded first, so that the whole cycle is ingested in one transaction
+        await self.loadMissingChallenges("les joueurs interrogés", [api_solve for _, api_solve in new_solves])
+        # Consecutive solves of the same user are ingested as one batch
+        batches = [(user_id, [api_solve for _, api_solve in user_solves]) for user_id, user_solves in groupby(new_solves, key=lambda s: s[0])]
+
+        def ingest(db):
+            results = [db.add_solves_to_user(user_id, api_solves) for user_id, api_solves in batches]
+            db.setObservedStates(observed)
+            return results
+
+        results = await self.db.transaction(ingest)
+        for announcements, missing in results:
+            for api_solve in missing:
+                print(f"Le challenge {api_solve['titre']} n'a pas pu être ajouté, le solve est ignoré")
+            for solve in announcements:
+                yield solve
+
+    async def pendingValidations(self, user_id, user_data):
+        """(API state, validations maybe missing from the db from oldest to newest), (None, []) when nothing changed"""
+        sync_state = await self.db.getUserSyncState(user_id)
+        if sync_state is None:
+            return None, []
+        score, solve_count, last_date, observed = sync_state
+        validations = user_data["validations"]
+        # The API score may never match the db one (e.g. a challenge whose score changed)
+        state = f"{user_data.get('score')},{len(validations)}"
+        if state in (f"{score},{solve_count}", observed):
+            return None, []
+
+        if last_date is not None and len(validations) == solve_count:
+            # Solves are stored by day, so the last stored day is checked again. When the
+            # number of solves differs, an older validation is missing and all are checked
+            last_date = last_date.strftime("%Y-%m-%d")
+            validations = [v for v in validations if v["date"][:10] >= last_date]
+        return state, list(reversed(validations))  # sort from oldest to newest
 
     async def loadChallenge(self, idx):
-        x = self.db.getChallengeById(idx)
+        """Fetch and store a challenge, at most CHALLS_SYNC_CONCURRENCY at a time"""
+        x = await self.db.getChallengeById(idx)
         if x is not None:
             # print(f"{x} already loaded in db")
             return None
 
-        chall_data = await self.fetchChallenge(idx)
         try:
-            self.db.newChallenge(chall_data)
+            async with self.challs_loads:
+                chall_data = await self.fetchChallenge(idx)
+        except RootMeAPIError as e:
+            # the solves of this challenge are ignored until a later sync loads it
+            print(f"Could not load challenge {idx}: {e}")
+            return None
+        try:
+            await self.db.newChallenge(chall_data)
             return chall_data["id_trad"]
         except:
             print(f"{chall_data = }")
 
-    async def loadAllChallenges(self):
+    async def loadAllChallenges(self, concurrent=True, full=False):
+        """Load the challenges of the listing missing from the db, returns the id_trad of the new ones"""
+        known_ids = await self.db.getChallengeIds()
+        last_full_sync = float(await self.db.getSyncState('challs_last_full_sync') or 0)
+        full = full or time.time() - last_full_sync > CHALLS_FULL_SYNC_DELAY
+
         start = 0
-        new_challs = []
-        while True:
-            data = await self.fetch(f"{self.BASE_API}/challenges/?debut_challenges={start}")
-            challenges, next = data[0], data[-1]
-            start = int(next['href'].split('=')[1])
-
-            # results = await asyncio.gather(*(self.loadChallenge(chall["id_challenge"]) for idx, chall in challenges.items()))
-            results = []
-            for idx, chall in challenges.items():
-                results.append(await self.loadChallenge(chall["id_challenge"]))
-
-            new_challs.extend([c for c in results if c is not None])
-            if next['rel'] == 'previous':
-                break
-        return new_challs
+        results, tasks = [], []
+        try:
+            while True:
+                data = await self.fetch(f"{self.BASE_API}/challenges/?debut_challenges={start}")
+                challenges, next = data[0], data[-1]
+                start = int(next['href'].split('=')[1])
+
+                ids = [int(chall["id_challenge"]) for idx, chall in challenges.items()]
+                loads = [self.loadChallenge(idx) for idx in ids if idx not in known_ids]
+                if concurrent:
+                    tasks.extend(asyncio.create_task(l) for l in loads)
+                else:
+                    results.extend([await l for l in loads])
+
+                # A page without new challenge that lists them newest first is a high-water mark: the
+                # following pages only hold older ones. An oldest first listing is always walked whole
+                if next['rel'] == 'previous' or (not loads and not full and ids == sorted(ids, reverse=True)):
+                    break
+
+            results.extend(await asyncio.gather(*tasks))
+        finally:
+            # a failed page fetch must not leave detail loads running unawaited
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if full:
+            await self.db.setSyncState({'challs_last_full_sync': str(time.time())})
+            for table, fixed in (await self.db.rebuildStats()).items():
+                if fixed:
+                    print(f"{fixed} rows of {table} were out of date")
+        await self.db.refreshCatalog()
+
+        return [c for c in results if c is not None]
 
     async def loadUser(self, name = None, idx = None):
+        """Register a user and their validations, loading the challenges missing from the db first"""
         if name is None and idx is None:
             raise Exception('loadUser with None name and idx')
 
@@ -93,21 +201,166 @@ class RootMeAPI(aiohttp.ClientSession):
                 raise Exception(f'User {name} got multiple result')
             user = user['0']
 
+        await self.loadMissingChallenges(user['nom'], user['validations'])
         await self.db.newUser(user)
 
-    async def fetch(self, url, params=None):
+    async def loadUsers(self, entries, progress=None, workers=USERS_IMPORT_WORKERS):
+        """Register many users given by name or id, returns the names 'added', 'known', 'ambiguous' and 'not_found'"""
+        entries = list(dict.fromkeys(entry.strip() for entry in entries if entry.strip()))
+        report = {'added': [], 'known': [], 'ambiguous': {}, 'not_found': []}
+        semaphore = asyncio.Semaphore(workers)
+        done = 0
+
+        async def resolve(entry):
+            nonlocal done
+            async with semaphore:
+                try:
+                    user, candidates = await self.resolveUser(entry)
+                except RootMeAPIError as e:
+                    print(f"Could not import {entry}: {e}")
+                    user, candidates = None, []
+            if user is None and len(candidates) > 1:
+                report['ambiguous'][entry] = candidates
+            elif user is None:
+                report['not_found'].append(entry)
+            done += 1
+            if progress is not None:
+                await progress(done, len(entries))
+            return user
+
+        users = [user for user in await asyncio.gather(*(resolve(entry) for entry in entries)) if user]
+        validations = [chall for user in users for chall in user['validations']]
+        await self.loadMissingChallenges(f"{len(users)} users", validations)
+
+        report['added'] = await self.db.newUsers(users)
+        report['known'] = sorted({user['nom'] for user in users} - set(report['added']))
+        return report
+
+    async def resolveUser(self, entry):
+        """(user data, []) for an id or a name, else (None, names of the users matching the name)"""
+        if entry.isdigit():
+            user = await self.fetchUserById(entry)
+            if user:
+                return user, []
+
+        users = list((await self.fetchUserByName(entry) or {}).values())
+        exact = [user for user in users if user['nom'].lower() == entry.lower()]
+        if len(users) == 1:
+            idx = users[0]['id_auteur']
+        elif len(exact) == 1:
+            idx = exact[0]['id_auteur']
+        else:
+            return None, [user['nom'] for user in users]
+        return await self.fetchUserById(idx) or None, []
+
+    async def loadMissingChallenges(self, solver, validations):
+        """Load the challenges of `validations` which are not in the db yet"""
+        missing = await self.db.getMissingChallengeIds(chall['id_challenge'] for chall in validations)
+        if not missing:
+            return
+        print(f"{len(missing)} challenges résolus par {solver} ne sont pas dans la bdd. On les ajoute...")
+        await asyncio.gather(*(self.loadChallenge(idx) for idx in missing))
+
+    async def fetch(self, url, params=None, fresh=False):
+        """GET an API endpoint, cached per endpoint TTL unless `fresh`, identical concurrent calls sharing one request"""
+        endpoint = self.endpoint(url)
+        stats = self.stats[endpoint]
+        cache_key = self.cache.key(url, params)
+        if not fresh:
+            data = self.cache.get(cache_key)
+            if data is not None:
+                stats['cache_hits'] += 1
+                return data
+
+        request = self.inflight.get(cache_key)
+        if request is not None:
+            stats['coalesced'] += 1
+        else:
+            request = asyncio.ensure_future(self.request(url, params, endpoint, cache_key))
+            self.inflight[cache_key] = request
+            request.add_done_callback(lambda r: self.requestDone(cache_key, r))
+        # Cancelling one caller must not cancel the request shared with the others
+        return await asyncio.shield(request)
+
+    def requestDone(self, cache_key, request):
+        self.inflight.pop(cache_key, None)
+        if not request.cancelled():
+            request.exception()  # retrieved here in case every caller went away
+
+    async def request(self, url, params, endpoint, cache_key):
+        """Send a request through the token bucket, retrying transient errors with backoff and honoring Retry-After"""
         cookies = {"api_key": self.api_key}
         headers = {
             'User-Agent': 'toto'
         }
+        stats = self.stats[endpoint]
         print(url)
-        async with self.get(url, cookies=cookies, headers=headers, params=params) as response:
-            text = await response.text()
-            # print(text)
-            return json.loads(text)
+        for attempt in range(API_MAX_RETRIES + 1):
+            await self.rate_limit.acquire()
+            stats['requests'] += 1
+            retry_after = None
+            try:
+                async with self.get(url, cookies=cookies, headers=headers, params=params) as response:
+                    status = response.status
+                    text = await response.text()
+                    if status == 429 or status >= 500:
+                        retry_after = self.retryAfter(response)
+                        error = f"HTTP {status}"
+                    else:
+                        try:
+                            data = json.loads(text)
+                            if status == 200:
+                                self.cache.put(cache_key, endpoint, data, len(text))
+                            return data
+                        except json.JSONDecodeError:
+                            if status >= 400:
+                                stats['errors'] += 1
+                                raise RootMeAPIError(f"{endpoint} answered HTTP {status}", url, status)
+                            error = "invalid JSON"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status, error = None, repr(e)
+
+            stats['throttled' if status == 429 else 'retries'] += 1
+            if attempt == API_MAX_RETRIES:
+                break
+
+            delay = random.uniform(0, min(API_BACKOFF_MAX, API_BACKOFF_BASE * 2 ** attempt))
+            if retry_after is not None:
+                # Everybody waits, not only this request
+                self.rate_limit.pause(retry_after)
+                delay = max(delay, retry_after)
+            print(f"{endpoint}: {error}, retrying in {delay:.1f}s ({attempt + 1}/{API_MAX_RETRIES})")
+            await asyncio.sleep(delay)
+
+        stats['errors'] += 1
+        raise RootMeAPIError(f"{endpoint} failed after {API_MAX_RETRIES + 1} attempts: {error}", url, status)
+
+    @staticmethod
+    def endpoint(url):
+        """Name used to group the request counters, e.g. /auteurs/{id}"""
+        path = re.sub(r'/+', '/', urlparse(url).path).rstrip('/')
+        return re.sub(r'/\d+(?=/|$)', '/{id}', path)
+
+    @staticmethod
+    def retryAfter(response):
+        value = response.headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            return max(0, float(value))
+        except ValueError:
+            try:
+                return max(0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                return None
+
+    def requestStats(self):
+        """Per endpoint counters: requests sent, cache hits, coalesced calls, retries, 429 received and failed calls"""
+        return {endpoint: dict(counters) for endpoint, counters in self.stats.items()}
 
 async def main():
-    async with RootMeAPI('365797_298ddfe31e07546808d7714063b2c88e7f92237c5d9118279c65f345d0261162') as api:
+    load_dotenv("./.env")
+    async with RootMeAPI(os.getenv('ROOTME_API')) as api:
 
 
         # await api.loadAllChallenges()
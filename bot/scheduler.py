@@ -0,0 +1,69 @@
+import time
+from collections import deque
+
+
+class PollScheduler():
+    """
+    Decides when each tracked user is polled next.
+    The poll interval grows with the time elapsed since the user's last solve,
+    from `min_interval` for active players up to `max_interval` for dormant
+    ones, and at most `budget` users are polled per minute overall.
+    """
+    def __init__(self, min_interval: float, max_interval: float, activity_ratio: float, budget: int) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.activity_ratio = activity_ratio
+        self.budget = budget
+        self.next_poll = {}  # user id => timestamp of the next poll
+        self.last_activity = {}  # user id => timestamp of the last known solve
+        self.polls = deque()  # timestamps of the polls of the last minute
+
+    def tracked(self) -> set:
+        return set(self.next_poll)
+
+    def interval(self, user_id, now: float) -> float:
+        last_activity = self.last_activity.get(user_id)
+        if last_activity is None:
+            return self.max_interval
+        age = max(0, now - last_activity)
+        return min(self.max_interval, max(self.min_interval, age / self.activity_ratio))
+
+    def sync(self, last_activity: dict, now: float = None) -> None:
+        """
+        Track the users of `last_activity` (user id => timestamp of the last
+        solve, or None) and forget the others. New users are due right away.
+        Afterwards `polled` keeps the last activities up to date, so this is only
+        needed again when users are registered or removed.
+        """
+        now = time.time() if now is None else now
+        for user_id in self.next_poll.keys() - last_activity.keys():
+            del self.next_poll[user_id]
+            self.last_activity.pop(user_id, None)
+
+        for user_id, timestamp in last_activity.items():
+            if timestamp is not None and timestamp > self.last_activity.get(user_id, 0):
+                self.last_activity[user_id] = timestamp
+            if user_id not in self.next_poll:
+                self.next_poll[user_id] = now
+
+    def due(self, now: float = None) -> list:
+        """Users to poll now, the most overdue first, within what remains of the budget"""
+        now = time.time() if now is None else now
+        while self.polls and self.polls[0] <= now - 60:
+            self.polls.popleft()
+
+        available = self.budget - len(self.polls)
+        if available <= 0:
+            return []
+        due = sorted((t, user_id) for user_id, t in self.next_poll.items() if t <= now)
+        return [user_id for _, user_id in due[:available]]
+
+    def polled(self, user_ids, active_ids=(), now: float = None) -> None:
+        """Reschedule polled users, `active_ids` being those who had new solves"""
+        now = time.time() if now is None else now
+        for user_id in user_ids:
+            self.polls.append(now)
+            if user_id in active_ids:
+                self.last_activity[user_id] = now
+            if user_id in self.next_poll:
+                self.next_poll[user_id] = now + self.interval(user_id, now)
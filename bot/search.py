@@ -0,0 +1,52 @@
+"""
+Full text search over the challenge titles/subtitles and the user names.
+
+The FTS5 tables (trigram tokenizer) hold the normalized text of the indexed
+columns, with the id of the challenge or user as rowid. Triggers created by the
+migrations keep them in sync, using the normalize() SQL function registered on
+every connection.
+"""
+import unicodedata
+
+from sqlalchemy import column, func, literal_column, null, or_, table
+
+challenges_fts = table("challenges_fts", column("rowid"), column("title"), column("subtitle"))
+users_fts = table("users_fts", column("rowid"), column("name"))
+
+# trigrams: shorter queries can not use the MATCH operator
+MIN_MATCH_LENGTH = 3
+
+
+def normalize(value):
+    """Lower case and accents stripped, "Réseau" => "reseau" """
+    if value is None:
+        return None
+    return ''.join(c for c in unicodedata.normalize('NFKD', value) if not unicodedata.combining(c)).casefold()
+
+
+def register(dbapi_connection) -> None:
+    dbapi_connection.create_function("normalize", 1, normalize, deterministic=True)
+
+
+def matches(fts_table, text, column_name=None):
+    """
+    Condition on `fts_table` for the rows containing `text`, accents and case ignored.
+    `column_name` restricts the search to one of the indexed columns.
+    """
+    text = normalize(text)
+    if len(text) < MIN_MATCH_LENGTH:
+        escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        columns = [column_name] if column_name else [c.name for c in fts_table.c if c.name != 'rowid']
+        return or_(*(fts_table.c[name].like(f"%{escaped}%", escape='\\') for name in columns))
+
+    query = '"' + text.replace('"', '""') + '"'
+    if column_name:
+        query = f"{column_name} : {query}"
+    return literal_column(fts_table.name).op("MATCH")(query)
+
+
+def rank(fts_table, text, *weights):
+    """Relevance of the rows selected by matches(), best first when sorted ascending"""
+    if len(normalize(text)) < MIN_MATCH_LENGTH:
+        return null()
+    return func.bm25(literal_column(fts_table.name), *weights)
@@ -10,7 +10,6 @@ import matplotlib.pyplot as plt
 from matplotlib.font_manager import FontProperties
 import io
 from PIL import Image, ImageDraw, ImageFont
-import requests
 import numpy as np
 import textwrap
 
@@ -118,7 +117,7 @@ async def new_chall(channel: TextChannel, chall_list) -> None:
 
         await channel.send(file=file, embed=embed)
 
-async def new_solves(channel: TextChannel, solve: tuple[User, Challenge, str, int, bool, list, int]) -> None:
+async def new_solves(channel: TextChannel, solve: tuple[User, Challenge, str, int, bool, list, int], avatar: str) -> None:
     user, chall, next_user, points_to_reach, firstblood, overtakens, step = solve
     # for solve in solve_list:
     if firstblood : emoji=":drop_of_blood:"
@@ -133,14 +132,7 @@ async def new_solves(channel: TextChannel, solve: tuple[User, Challenge, str, in
     embed.set_image(url='attachment://chall_card.png')
 
 
-    if requests.head(f"https://www.root-me.org/IMG/logo/auton{user.id}.jpg").status_code == 200 :
-        pp = f"https://www.root-me.org/IMG/logo/auton{user.id}.jpg"
-    elif requests.head(f"https://www.root-me.org/IMG/logo/auton{user.id}.png").status_code == 200 :
-        pp = f"https://www.root-me.org/IMG/logo/auton{user.id}.png"
-    else : 
-        pp = f"https://www.root-me.org/IMG/logo/auton0.png"
-
-    embed.set_thumbnail(url=pp)
+    embed.set_thumbnail(url=avatar)
 
 
     embed.add_field(name=f'{chall.title}', value="")
@@ -174,17 +166,10 @@ async def overtook_msg(channel: TextChannel, user_name: str, overtakens: list) -
     await channel.send(embed=embed)
 
 
-async def last_solves_msg(ctx: commands.Context, user: User, solves: list, n_days: int) -> None:
+async def last_solves_msg(ctx: commands.Context, user: User, solves: list, n_days: int, avatar: str) -> None:
     message_title = f"Last solves of {user.name} the past {n_days} days"
     embed = discord.Embed(color=Color.blue(), title=message_title, description=f"*ID : {user.id}\nScore : {user.score}*")
-    if requests.head(f"https://www.root-me.org/IMG/logo/auton{user.id}.jpg").status_code == 200 :
-        pp = f"https://www.root-me.org/IMG/logo/auton{user.id}.jpg"
-    elif requests.head(f"https://www.root-me.org/IMG/logo/auton{user.id}.png").status_code == 200 :
-        pp = f"https://www.root-me.org/IMG/logo/auton{user.id}.png"
-    else : 
-        pp = f"https://www.root-me.org/IMG/logo/auton0.png"
-    
-    embed.set_thumbnail(url=pp)
+    embed.set_thumbnail(url=avatar)
     for solve in solves:
         embed.add_field(name=f"{solve[1]} ({solve[2]} points)", value=f"Solved on {solve[0].strftime('%d %B %Y')}", inline=False)
 
@@ -304,6 +289,44 @@ async def added_ok(ctx: commands.Context, name) -> None:
     embed = discord.Embed(color=Color.green(), title=message_title, description=message)
     await ctx.reply(embed=embed)
 
+async def nothing_to_import_msg(ctx: commands.Context) -> None:
+    title = 'Nothing to import :thinking:'
+    description = 'Give comma separated names or UIDs, or attach a file with one name or UID per line'
+    embed = discord.Embed(color=Color.red(), title=title, description=description)
+    await ctx.reply(embed=embed)
+
+async def import_progress_msg(ctx: commands.Context, done: int, total: int, message: discord.Message = None) -> discord.Message:
+    embed = discord.Embed(color=Color.blue(), title='Importing users :inbox_tray:', description=f'{done}/{total} users resolved')
+    if message is None:
+        return await ctx.reply(embed=embed)
+    await message.edit(embed=embed)
+    return message
+
+async def import_report_msg(ctx: commands.Context, report: dict) -> None:
+    def names(values):
+        text = ', '.join(escape_markdown(str(v)) for v in values)
+        return text if len(text) <= 1024 else text[:1020] + ' ...'
+
+    problems = report['ambiguous'] or report['not_found']
+    embed = discord.Embed(color=Color.orange() if problems else Color.green(), title='Import done',
+                          description=f"{len(report['added'])} users added :+1:")
+    if report['added']:
+        embed.add_field(name='Added', value=names(report['added']), inline=False)
+    if report['known']:
+        embed.add_field(name='Already registered', value=names(report['known']), inline=False)
+    if report['ambiguous']:
+        embed.add_field(name='Multiple users found, use their UID', inline=False,
+                        value=names(f"{entry} ({len(candidates)} users)" for entry, candidates in report['ambiguous'].items()))
+    if report['not_found']:
+        embed.add_field(name='Not found', value=names(report['not_found']), inline=False)
+    await ctx.reply(embed=embed)
+
+async def missing_permissions_msg(ctx: commands.Context) -> None:
+    title = 'Missing permissions :no_entry:'
+    description = 'This command is reserved to the administrators of the server'
+    embed = discord.Embed(color=Color.red(), title=title, description=description)
+    await ctx.reply(embed=embed)
+
 async def removed_ok(ctx: commands.Context, name) -> None:
     message_title = 'Success'
     message = f'{escape_markdown(name)} was successfully removed :cry:\nWe will miss him/her :('
@@ -311,10 +334,19 @@ async def removed_ok(ctx: commands.Context, name) -> None:
     embed = discord.Embed(color=Color.green(), title=message_title, description=message)
     await ctx.reply(embed=embed)
 
+async def stats_rebuilt_msg(ctx: commands.Context, fixed: dict) -> None:
+    message_title = 'Success'
+    if any(fixed.values()):
+        message = 'Stats rebuilt :wrench:\n' + '\n'.join(f'{table}: {count} rows were out of date' for table, count in fixed.items() if count)
+    else:
+        message = 'Stats rebuilt, everything was already up to date :+1:'
+
+    embed = discord.Embed(color=Color.green(), title=message_title, description=message)
+    await ctx.reply(embed=embed)
+
 async def who_solved_msg(ctx: commands.Context, chall_name, solvers) -> None:
     title = f'Solvers of {chall_name} :sunglasses:'
     embed = discord.Embed(color=Color.purple(), title=title, description="")
-    solvers = sorted(solvers, key=lambda s: s[1], reverse=True)
 
     if len(solvers) == 0 : embed.description = f'Nobody has solved {chall_name}. \nTry hard and be the first ! :index_pointing_at_the_viewer:'
     if len(solvers) == 1 : embed.description = f'That\'s what we call a giga boss :heart_eyes:'
@@ -324,7 +356,41 @@ async def who_solved_msg(ctx: commands.Context, chall_name, solvers) -> None:
 
     await ctx.reply(embed=embed)
 
-async def profile(ctx: commands.Context, user:User, stats) -> None:
+async def latency_msg(ctx: commands.Context, histogram) -> None:
+    # Discord drops the autocomplete answers sent after 3 seconds
+    deadline = 3000
+    title = 'Autocomplete latency :stopwatch:'
+    color = Color.green() if histogram.max < deadline else Color.orange()
+    embed = discord.Embed(color=color, title=title, description=histogram.summary())
+    embed.add_field(name='Within the deadline', value=f'{histogram.share_under(deadline):.2%}', inline=False)
+    await ctx.reply(embed=embed)
+
+async def api_stats_msg(ctx: commands.Context, stats: dict) -> None:
+    title = 'Root-Me API requests :satellite:'
+    embed = discord.Embed(color=Color.blue(), title=title, description="")
+
+    if len(stats) == 0: embed.description = 'No request sent yet :sleeping:'
+
+    for endpoint, counters in sorted(stats.items()):
+        embed.add_field(name=endpoint, value=', '.join(f"{counters.get(name, 0)} {name.replace('_', ' ')}" for name in
+                        ('requests', 'cache_hits', 'coalesced', 'retries', 'throttled', 'errors')), inline=False)
+
+    await ctx.reply(embed=embed)
+
+async def rarest_msg(ctx: commands.Context, challenges: list) -> None:
+    title = 'Rarest challenges :gem:'
+    embed = discord.Embed(color=Color.purple(), title=title, description="")
+
+    if len(challenges) == 0: embed.description = 'Nobody solved any challenge yet :sleeping:'
+
+    for chall, first_solver in challenges:
+        solvers = 'solver' if chall.solve_count == 1 else 'solvers'
+        embed.add_field(name=f"{chall.title} ({chall.score} points)",
+                        value=f"{chall.solve_count} {solvers}, first blood by {escape_markdown(first_solver)}", inline=False)
+
+    await ctx.reply(embed=embed)
+
+async def profile(ctx: commands.Context, user:User, stats, avatar: str) -> None:
     
     def create_text_image(title, value, width=350, height=200):
         border_thickness = -1
@@ -402,14 +468,7 @@ async def profile(ctx: commands.Context, user:User, stats) -> None:
     message_title = f"Profile of {user.name}"
     embed = discord.Embed(color=Color.blue(), title=message_title, description=f"*ID : {user.id}\nScore : {user.score}*")
 
-    if requests.head(f"https://www.root-me.org/IMG/logo/auton{user.id}.jpg").status_code == 200 :
-        pp = f"https://www.root-me.org/IMG/logo/auton{user.id}.jpg"
-    elif requests.head(f"https://www.root-me.org/IMG/logo/auton{user.id}.png").status_code == 200 :
-        pp = f"https://www.root-me.org/IMG/logo/auton{user.id}.png"
-    else : 
-        pp = f"https://www.root-me.org/IMG/logo/auton0.png"
-
-    embed.set_thumbnail(url=pp)
+    embed.set_thumbnail(url=avatar)
 
     embed.set_image(url="attachment://score.png")
     await ctx.send(embed=embed, file=file)